@@ -0,0 +1,409 @@
+# This program is used to benchmark the image processing functions used in the green view
+# index calculation (GreenView_Calculate.py) on real GSV images. The input is a list of GSV
+# images downloaded before, for example the images saved from the Street View Static API
+# with size=400x400&fov=60, each image is cropped in the center to the size of GSV images
+
+# Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT
+
+try:
+    from . import GreenView_Calculate
+    from . import panoramaProjection
+    from . import vegetationKernel
+except (ImportError, ValueError):
+    import GreenView_Calculate
+    import panoramaProjection
+    import vegetationKernel
+
+
+def LoadGSVImages(imgFiles, size=400):
+    '''
+    This function is used to read the GSV images and crop them to size x size
+    in the center, the images smaller than size will be resized
+
+    Parameters:
+        imgFiles: the list of the file names of the GSV images
+        size: the size of the cropped images
+
+    return the list of the numpy array images, uint8 in shape of (size, size, 3)
+    '''
+
+    from PIL import Image
+    import numpy as np
+
+    imgs = []
+    for imgFile in imgFiles:
+        img = Image.open(imgFile).convert('RGB')
+        width, height = img.size
+        if width < size or height < size:
+            img = img.resize((size, size))
+        else:
+            left = (width - size)//2
+            top = (height - size)//2
+            img = img.crop((left, top, left + size, top + size))
+
+        imgs.append(np.array(img))
+
+    return imgs
+
+
+
+def _timeit(func, repeat):
+    '''run func repeat times and return the average time in millisecond'''
+
+    import time
+
+    start = time.time()
+    for i in range(repeat):
+        func()
+
+    return (time.time() - start)/repeat*1000
+
+
+
+def _originalGraythresh(array,level):
+    '''
+    The verbatim copy of the graythresh function replaced by LevelHistogram and
+    graythreshHist, used as the baseline of BenchmarkOtsu. It only scales the
+    array by 255 when its maximum is not over 1, it counts the histogram with
+    np.histogram on the 257 edges of the float data, so the levels are truncated
+    instead of rounded, and it writes 0 into the negative values of the array
+    when it is not scaled, pass a copy. The branch of maxVal >= 256 calls np.int,
+    which is not in the recent numpy, it is never taken by the ExG images
+    '''
+    
+    import numpy as np
+    
+    maxVal = np.max(array)
+    minVal = np.min(array)
+    
+#   if the inputImage is a float of double dataset then we transform the data 
+#   in to byte and range from [0 255]
+    if maxVal <= 1:
+        array = array*255
+        # print "New max value is %s" %(np.max(array))
+    elif maxVal >= 256:
+        array = np.int((array - minVal)/(maxVal - minVal))
+        # print "New min value is %s" %(np.min(array))
+    
+    # turn the negative to natural number
+    negIdx = np.where(array < 0)
+    array[negIdx] = 0
+    
+    # calculate the hist of 'array'
+    dims = np.shape(array)
+    hist = np.histogram(array,range(257))
+    P_hist = hist[0]*1.0/np.sum(hist[0])
+    
+    omega = P_hist.cumsum()
+    
+    temp = np.arange(256)
+    mu = P_hist*(temp+1)
+    mu = mu.cumsum()
+    
+    n = len(mu)
+    mu_t = mu[n-1]
+    
+    sigma_b_squared = (mu_t*omega - mu)**2/(omega*(1-omega))
+    
+    # try to found if all sigma_b squrered are NaN or Infinity
+    indInf = np.where(sigma_b_squared == np.inf)
+    
+    CIN = 0
+    if len(indInf[0])>0:
+        CIN = len(indInf[0])
+    
+    maxval = np.max(sigma_b_squared)
+    
+    IsAllInf = CIN == 256
+    if IsAllInf !=1:
+        index = np.where(sigma_b_squared==maxval)
+        idx = np.mean(index)
+        threshold = (idx - 1)/255.0
+    else:
+        threshold = level
+    
+    if np.isnan(threshold):
+        threshold = level
+    
+    return threshold
+
+
+
+def BenchmarkOtsu(imgFiles, repeat=20, segmenter='quantize'):
+    '''
+    This function is used to compare the OTSU thresholding on the ExG images of
+    the segmented GSV images. Three methods are timed, the original graythresh
+    (see _originalGraythresh), graythresh based on np.bincount of the uint8
+    levels, and graythreshHist on a precomputed histogram. The new methods count
+    the same histogram as the original one, so the number of the same thresholds
+    should be the number of the images and the error of the green view index of
+    the mask of VegetationMask with the original threshold against the new
+    threshold should be 0, both are reported
+
+    Parameters:
+        imgFiles: the list of the file names of the GSV images
+        repeat: the number of the runs of each method on every image
+        segmenter: the segmentation backend used before the thresholding
+
+    return the average time of the three methods in millisecond per image, the mean
+        and the max absolute GVI error of the new threshold against the original one
+    '''
+
+    import warnings
+    import numpy as np
+
+    imgs = [GreenView_Calculate.getSegmenter(segmenter)(img) for img in LoadGSVImages(imgFiles)]
+
+    timeOriginal = 0
+    timeBincount = 0
+    timePrecomputed = 0
+    numSame = 0
+    errors = []
+
+    for img in imgs:
+        I = img/255.0
+        ExG = (I[:,:,1] - I[:,:,0]) + (I[:,:,1] - I[:,:,2])
+        hist = GreenView_Calculate.GraythreshHistogram(ExG)
+
+        # the original function writes into its input, and divides by zero on the empty levels
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            timeOriginal += _timeit(lambda: _originalGraythresh(ExG.copy(), 0.1), repeat)
+            original = _originalGraythresh(ExG.copy(), 0.1)
+        timeBincount += _timeit(lambda: GreenView_Calculate.graythresh(ExG, 0.1), repeat)
+        timePrecomputed += _timeit(lambda: GreenView_Calculate.graythreshHist(hist, 0.1), repeat)
+
+        threshold = GreenView_Calculate.graythresh(ExG, 0.1)
+        if original == threshold:
+            numSame = numSame + 1
+
+        # the green view index with the two thresholds, the same masks otherwise
+        originalGVI = np.count_nonzero(GreenView_Calculate.VegetationMask(img, original))/float(ExG.size)*100
+        GVI = np.count_nonzero(GreenView_Calculate.VegetationMask(img, threshold))/float(ExG.size)*100
+        errors.append(abs(GVI - originalGVI))
+
+    numImg = len(imgs)
+    res = (timeOriginal/numImg, timeBincount/numImg, timePrecomputed/numImg, np.mean(errors), np.max(errors))
+
+    print('The number of GSV images is: %s'%(numImg))
+    print('original graythresh: %.3f ms, bincount OTSU: %.3f ms, precomputed histogram: %.3f ms'%res[:3])
+    print('The same threshold on %s of %s images'%(numSame, numImg))
+    print('The GVI error against the original threshold, mean: %.3f, max: %.3f'%res[3:])
+
+    return res
+
+
+
+def BenchmarkSegmentation(imgFiles, segmenters=('meanshift', 'quantize', 'none'), reference='meanshift'):
+    '''
+    This function is used to report the speed and the accuracy of the segmentation
+    backends. For every backend, the time of the classification per image and the
+    error of the green view index against the reference backend are reported, the
+    backends which can not be imported (e.g. pymeanshift is not installed) are skipped
+
+    Parameters:
+        imgFiles: the list of the file names of the GSV images
+        segmenters: the names of the segmentation backends to compare
+        reference: the name of the backend used as the ground truth
+
+    return a dictionary, backend: (time per image in ms, mean absolute GVI error, max absolute GVI error)
+    '''
+
+    import time
+    import numpy as np
+
+    imgs = LoadGSVImages(imgFiles)
+
+    greenPercents = {}
+    times = {}
+    for segmenter in segmenters:
+        try:
+            start = time.time()
+            greenPercents[segmenter] = np.array([GreenView_Calculate.VegetationClassification(img, segmenter=segmenter) for img in imgs])
+            times[segmenter] = (time.time() - start)/len(imgs)*1000
+        except ImportError as e:
+            print('The segmentation backend %s is not available: %s'%(segmenter, e))
+
+    if reference not in greenPercents:
+        print('The reference backend %s is not available'%(reference))
+        return {}
+
+    report = {}
+    print('backend      ms/image   mean |GVI error|   max |GVI error|')
+    for segmenter in segmenters:
+        if segmenter not in greenPercents:
+            continue
+
+        error = np.abs(greenPercents[segmenter] - greenPercents[reference])
+        report[segmenter] = (times[segmenter], error.mean(), error.max())
+        print('%-12s %8.1f %18.3f %17.3f'%((segmenter,) + report[segmenter]))
+
+    return report
+
+
+
+def BenchmarkResolution(imgFiles, sizes=(100, 200, 300, 400, 640), segmenter='quantize'):
+    '''
+    This function is used to choose the size of the GSV images, the images are
+    resized to every size and classified, the time of the classification per image
+    and the error of the green view index against the largest size are reported,
+    so a cheaper size can be chosen for a city if its error is small enough. Use
+    the images downloaded at the largest size, e.g. size=640x640&fov=60
+
+    Parameters:
+        imgFiles: the list of the file names of the GSV images
+        sizes: the widths and heights of the images to compare
+        segmenter: the segmentation backend used to classify the images
+
+    return a dictionary, size: (time per image in ms, mean absolute GVI error, max absolute GVI error)
+    '''
+
+    import time
+    from PIL import Image
+    import numpy as np
+
+    sizes = sorted(sizes)
+    imgs = LoadGSVImages(imgFiles, sizes[-1])
+
+    greenPercents = {}
+    times = {}
+    for size in sizes:
+        resized = [np.array(Image.fromarray(img).resize((size, size), Image.BILINEAR)) for img in imgs]
+        workspace = GreenView_Calculate.VegetationWorkspace((1, size, size))
+
+        start = time.time()
+        greenPercents[size] = np.array([GreenView_Calculate.BatchVegetationClassification(img[np.newaxis], workspace,
+                                                                                          segmenter)[0]
+                                        for img in resized])
+        times[size] = (time.time() - start)/len(imgs)*1000
+
+    report = {}
+    print('size     ms/image   mean |GVI error|   max |GVI error|')
+    for size in sizes:
+        error = np.abs(greenPercents[size] - greenPercents[sizes[-1]])
+        report[size] = (times[size], error.mean(), error.max())
+        print('%-8s %8.1f %18.3f %17.3f'%(('%sx%s'%(size, size),) + report[size]))
+
+    return report
+
+
+
+def BenchmarkFusedKernel(imgFiles, repeat=20):
+    '''
+    This function is used to compare the speed of the per-pixel vegetation rules
+    on the GSV images, without the segmentation. Four versions are compared, the
+    float64 VegetationMask, the int16 IntegerVegetationMask, and the fused kernel
+    of FusedGreenPixelCount with numpy and compiled by numba (see vegetationKernel.py),
+    the last one is skipped if numba is not installed
+
+    Parameters:
+        imgFiles: the list of the file names of the GSV images
+        repeat: the number of the runs of each version on every image
+
+    return the average time of the four versions in millisecond per image, None
+        for the compiled kernel if numba is not installed
+    '''
+
+    import numpy as np
+    from functools import partial
+
+    imgs = LoadGSVImages(imgFiles)
+    compiled = vegetationKernel.HasCompiledKernel()
+
+    # the fused kernel with numpy, the same count as the compiled one
+    def numpyCount(img):
+        hist = vegetationKernel.ExGHistogram(img, compiled=False)
+        threshold = min(max(GreenView_Calculate.graythreshHist(hist, 0.1), 0.05), 0.1)
+        return vegetationKernel.GreenPixelCount(img, GreenView_Calculate.ExGLevelCutoff(threshold),
+                                                GreenView_Calculate.ExGLevelCutoff(0.05),
+                                                (GreenView_Calculate.RED_CUTOFF, GreenView_Calculate.GREEN_CUTOFF,
+                                                 GreenView_Calculate.BLUE_CUTOFF, GreenView_Calculate.SHADOW_CUTOFF),
+                                                compiled=False)
+
+    # compile the kernel before the timing
+    if compiled:
+        GreenView_Calculate.FusedGreenPixelCount(imgs[0])
+
+    times = [0, 0, 0, 0]
+    numSame = 0
+    for img in imgs:
+        versions = [lambda: np.count_nonzero(GreenView_Calculate.VegetationMask(img)),
+                    lambda: np.count_nonzero(GreenView_Calculate.IntegerVegetationMask(img)),
+                    partial(numpyCount, img)]
+        if compiled:
+            versions.append(partial(GreenView_Calculate.FusedGreenPixelCount, img))
+
+        for n, version in enumerate(versions):
+            times[n] += _timeit(version, repeat)
+
+        if len(set(version() for version in versions)) == 1:
+            numSame = numSame + 1
+
+    numImg = len(imgs)
+    res = tuple(t/numImg for t in times[:3]) + (times[3]/numImg if compiled else None,)
+
+    print('The number of GSV images is: %s'%(numImg))
+    print('float mask: %.3f ms, integer mask: %.3f ms, fused numpy: %.3f ms'%res[:3])
+    if compiled:
+        print('fused numba: %.3f ms, %.1fx faster than the float mask'%(res[3], res[0]/res[3]))
+    else:
+        print('numba is not installed, the fused kernel is not compiled')
+    print('The same green pixel count on %s of %s images'%(numSame, numImg))
+
+    return res
+
+
+
+def BenchmarkReprojection(panoFiles, headingArr=(0, 60, 120, 180, 240, 300), repeat=20):
+    '''
+    This function is used to report the speed of cutting the images of the headings
+    out of the equirectangular panoramas (see panoramaProjection.py), the time of
+    computing the lookup tables, and the time of cutting the images with the cached tables
+
+    Parameters:
+        panoFiles: the list of the file names of the equirectangular panoramas
+        headingArr: the heading angles of the images of every panorama
+        repeat: the number of the runs on every panorama
+
+    return the average time of computing the tables and of cutting the images in millisecond per panorama
+    '''
+
+    from PIL import Image
+    import numpy as np
+
+    panoramas = [np.array(Image.open(panoFile).convert('RGB')) for panoFile in panoFiles]
+    out = np.empty((len(headingArr), 400, 400, 3), dtype=np.uint8)
+
+    timeTable = 0
+    timeRemap = 0
+    for panorama in panoramas:
+        def buildTables():
+            panoramaProjection._remapTables.clear()
+            panoramaProjection.ReprojectPanorama(panorama, headingArr, out=out)
+
+        timeTable += _timeit(buildTables, 1)
+        timeRemap += _timeit(lambda: panoramaProjection.ReprojectPanorama(panorama, headingArr, out=out), repeat)
+
+    numPano = len(panoramas)
+    res = (timeTable/numPano, timeRemap/numPano)
+
+    print('The number of panoramas is: %s'%(numPano))
+    print('lookup tables: %.3f ms, images of %s headings with cached tables: %.3f ms'%(res[0], len(headingArr), res[1]))
+
+    return res
+
+
+
+# ------------------------------Main function-------------------------------
+if __name__ == "__main__":
+
+    import os,os.path
+
+    GSVimgFolder = 'MYPATH//spatial-data/gsv-images'
+    imgFiles = [os.path.join(GSVimgFolder, f) for f in os.listdir(GSVimgFolder) if f.endswith('.jpg')]
+
+    BenchmarkOtsu(imgFiles)
+    BenchmarkSegmentation(imgFiles)
+    BenchmarkResolution(imgFiles)
+    BenchmarkFusedKernel(imgFiles)
+
@@ -2,8 +2,13 @@
 # considering the facts many people are more comfortable with shapefile and GIS
 # Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT 
 
+try:
+    from .resultStore import ResultStore, UniqueResults
+except (ImportError, ValueError):
+    from resultStore import ResultStore, UniqueResults
 
-def Read_GSVinfo_Text(GVI_Res_txt):
+
+def Read_GSVinfo_Text(GVI_Res_txt, panoIDSet=None):
     '''
     This function is used to read the information in text files or folders
     the fundtion will remove the duplicate sites and only select those sites
@@ -14,6 +19,8 @@ def Read_GSVinfo_Text(GVI_Res_txt):
     
     Pamameters:
         GVI_Res_txt: the file name of the GSV information txt file
+        panoIDSet: the set of the panorama ids already read, shared by the txt
+            files to remove the duplicated panoramas across the files
     '''   
 
     import os,os.path
@@ -25,6 +32,10 @@ def Read_GSVinfo_Text(GVI_Res_txt):
     panoLatLst = []
     greenViewLst = []
     
+    # the panorama ids already read, a set is used to check the duplicates in constant time
+    if panoIDSet is None:
+        panoIDSet = set()
+    
     # read the green view index result txt files
     lines = open(GVI_Res_txt,"r")
     for line in lines:
@@ -45,11 +56,12 @@ def Read_GSVinfo_Text(GVI_Res_txt):
             continue
         
         elif float(greenView) < 0:
-            print greenView
+            print (greenView)
             continue
         
         # remove the duplicated panorama id
-        if panoID not in panoIDLst:
+        if panoID not in panoIDSet:
+            panoIDSet.add(panoID)
             panoIDLst.append(panoID)
             panoDateLst.append(panoDate)
             panoLonLst.append(lon)
@@ -60,6 +72,30 @@ def Read_GSVinfo_Text(GVI_Res_txt):
 
 
 
+def Read_GVI_store(storeFile, startDate=None, endDate=None, bbox=None):
+    '''
+    This function is used to read the green view index results in the result
+    store (greenView.res written by GreenView_Calculate.py), the duplicated
+    panoramas and the invalid green view indexes are removed with vectorized
+    operations, only the blocks of the store which can match the query are read
+    
+    Return:
+        panoIDLst,panoDateLst,panoLonLst,panoLatLst,greenViewLst, as numpy arrays,
+        the coordinates and green view indexes are numbers
+    
+    Pamameters:
+        storeFile: the file name of the result store
+        startDate, endDate: the first and the last panoDate 'YYYY-MM' to read, None for no limit
+        bbox: the (minLon, minLat, maxLon, maxLat) of the panoramas to read, None for no limit
+    '''
+    
+    records = UniqueResults(ResultStore(storeFile).query(startDate, endDate, bbox))
+    
+    return (records['panoID'].astype(str), records['panoDate'].astype(str), records['longitude'],
+            records['latitude'], records['greenview'])
+
+
+
 # read the green view index files into list, the input can be file or folder
 def Read_GVI_res(GVI_Res):
     '''
@@ -71,7 +107,8 @@ def Read_GVI_res(GVI_Res):
             panoIDLst,panoDateLst,panoLonLst,panoLatLst,greenViewLst
         
         Pamameters:
-            GVI_Res: the file name of the GSV information text, could be folder or txt file
+            GVI_Res: the file name of the GSV information text, could be folder or txt file,
+                or the result store (.res), see Read_GVI_store
         
         last modified by Xiaojiang Li, March 27, 2018
         '''
@@ -85,6 +122,12 @@ def Read_GVI_res(GVI_Res):
     panoLatLst = []
     greenViewLst = []
     
+    # the panorama ids of all the txt files
+    panoIDSet = set()
+    
+    # if the input gvi result is the result store
+    if GVI_Res.endswith('.res'):
+        return Read_GVI_store(GVI_Res)
     
     # if the input gvi result is a folder
     if os.path.isdir(GVI_Res):
@@ -98,16 +141,16 @@ def Read_GVI_res(GVI_Res):
             txtfilename = os.path.join(GVI_Res,txtfile)
             
             # call the function to read txt file to a list
-            [panoIDLst_tem,panoDateLst_tem,panoLonLst_tem,panoLatLst_tem,greenViewLst_tem] = Read_GSVinfo_Text(txtfilename)
+            [panoIDLst_tem,panoDateLst_tem,panoLonLst_tem,panoLatLst_tem,greenViewLst_tem] = Read_GSVinfo_Text(txtfilename, panoIDSet)
             
-            panoIDLst = panoIDLst + panoIDLst_tem
-            panoDateLst = panoDateLst + panoDateLst_tem
-            panoLonLst = panoLonLst + panoLonLst_tem
-            panoLatLst = panoLatLst + panoLatLst_tem
-            greenViewLst = greenViewLst + greenViewLst_tem
+            panoIDLst.extend(panoIDLst_tem)
+            panoDateLst.extend(panoDateLst_tem)
+            panoLonLst.extend(panoLonLst_tem)
+            panoLatLst.extend(panoLatLst_tem)
+            greenViewLst.extend(greenViewLst_tem)
 
     else: #for single txt file
-        [panoIDLst_tem,panoDateLst_tem,panoLonLst_tem,panoLatLst_tem,greenViewLst_tem] = Read_GSVinfo_Text(txtfilename)
+        [panoIDLst,panoDateLst,panoLonLst,panoLatLst,greenViewLst] = Read_GSVinfo_Text(GVI_Res, panoIDSet)
 
 
     return panoIDLst,panoDateLst,panoLonLst,panoLatLst,greenViewLst
@@ -153,7 +196,7 @@ def CreatePointFeature_ogr(outputShapefile,LonLst,LatLst,panoIDlist,panoDateList
     outLayer = data_source.CreateLayer(lyrname, targetSpatialRef, ogr.wkbPoint)
     numPnt = len(LonLst)
 
-    print 'the number of points is:',numPnt
+    print ('the number of points is:', numPnt)
 
     if numPnt > 0:
         # create a field
@@ -170,8 +213,8 @@ def CreatePointFeature_ogr(outputShapefile,LonLst,LatLst,panoIDlist,panoDateList
             #create point geometry
             point = ogr.Geometry(ogr.wkbPoint)
 
-            # in case of the returned panoLon and PanoLat are invalid
-            if len(LonLst[idx]) < 3:
+            # in case of the returned panoLon and PanoLat are invalid, the coordinates read from the result store are numbers
+            if isinstance(LonLst[idx], str) and len(LonLst[idx]) < 3:
                 continue      
         
             point.AddPoint(float(LonLst[idx]),float(LatLst[idx]))
@@ -195,7 +238,7 @@ def CreatePointFeature_ogr(outputShapefile,LonLst,LatLst,panoIDlist,panoDateList
         data_source.Destroy()
 
     else:
-        print 'You created a empty shapefile'
+        print ('You created a empty shapefile')
 
 
 
@@ -205,7 +248,7 @@ if __name__ == "__main__":
     import os
     import sys
     
-    inputGVIres = r'MYPATHH/spatial-data/greenViewRes'
+    inputGVIres = r'MYPATHH/spatial-data/greenViewRes' # or the result store, MYPATHH/spatial-data/greenViewRes/greenView.res
     outputShapefile = 'MYPATHH/spatial-data/GreenViewRes.shp'
     lyrname = 'greenView'
     [panoIDlist,panoDateList,LonLst,LatLst,greenViewList] = Read_GVI_res(inputGVIres)
@@ -1,4 +1,18 @@
 import Treepedia.metadataCollector 
 import Treepedia.Greenview2Shp
-import Treepedia.GreenViewCalc
+import Treepedia.GreenView_Calculate
 import Treepedia.createPoints
+import Treepedia.imageSegmentation
+import Treepedia.greenViewPipeline
+import Treepedia.keyScheduler
+import Treepedia.fileLock
+import Treepedia.imageCache
+import Treepedia.checkpoint
+import Treepedia.workQueue
+import Treepedia.metadataCache
+import Treepedia.panoIndex
+import Treepedia.resultStore
+import Treepedia.pipelineState
+import Treepedia.panoramaProjection
+import Treepedia.imageRing
+import Treepedia.vegetationKernel
@@ -0,0 +1,91 @@
+# This program is the checkpoint journal of the green view index calculation. The result of every
+# panorama is committed to the journal as soon as it is computed, so a crashed or stopped run can
+# be restarted without losing the finished panoramas, only the failed and unfinished panoramas are
+# computed again.
+
+# Every record is one json line appended to the journal with a single write and then flushed to
+# the disk, a line broken by a crash is ignored when the journal is read.
+
+# Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT
+
+import os,os.path
+import threading
+
+
+class PanoJournal(object):
+    '''
+    The journal of the results of the panoramas
+
+        journalFile: the file name of the journal
+        maxAttempts: the number of the failed attempts after which a panorama
+            is not computed again
+    '''
+
+    def __init__(self, journalFile, maxAttempts=3):
+        self.journalFile = journalFile
+        self.maxAttempts = maxAttempts
+        self.lock = threading.Lock()
+        self.records = {}
+        self.attempts = {}
+        self.load()
+
+    def load(self):
+        '''read the committed records of the journal'''
+
+        import json
+
+        self.records = {}
+        self.attempts = {}
+        if not os.path.exists(self.journalFile):
+            return
+
+        with open(self.journalFile, 'r') as lines:
+            for line in lines:
+                # skip the line broken by a crash
+                if not line.endswith('\n'):
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+
+                panoID = record['panoID']
+                self.records[panoID] = record
+                if record['status'] == 'failed':
+                    self.attempts[panoID] = self.attempts.get(panoID, 0) + 1
+
+    def isFinished(self, panoID):
+        '''
+        return True if the panorama is computed, or failed maxAttempts times
+        '''
+
+        record = self.records.get(panoID)
+        if record is None:
+            return False
+
+        return record['status'] == 'done' or self.attempts.get(panoID, 0) >= self.maxAttempts
+
+    def commit(self, record):
+        '''
+        append the record to the journal and flush it to the disk
+            record: the dictionary of the result of the panorama, it has the keys
+                of panoID and status, 'done' or 'failed'
+        '''
+
+        import json
+
+        line = json.dumps(record) + '\n'
+
+        with self.lock:
+            fd = os.open(self.journalFile, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line.encode('utf-8'))
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+            panoID = record['panoID']
+            self.records[panoID] = record
+            if record['status'] == 'failed':
+                self.attempts[panoID] = self.attempts.get(panoID, 0) + 1
+
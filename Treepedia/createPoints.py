@@ -4,98 +4,411 @@
 # First version July 21 2017
 
 
+# the cache of the coordinate transformers, building a transformer is much slower than using it
+_transformers = {}
+
+
+class ProjectionError(ValueError):
+    '''the coordinates of the street map can not be projected, the input is not in WGS84'''
+
+
+
+def ProjectionErrors():
+    '''
+    This function is used to get the exception types raised when the street map
+    can not be projected, ProjectionError and the errors of pyproj
+        return the tuple of the exception types
+    '''
+    
+    try:
+        from pyproj.exceptions import CRSError, ProjError
+    except ImportError:
+        # pyproj older than 2.0 has no exception types of its own
+        return (ProjectionError,)
+    
+    return (ProjectionError, CRSError, ProjError)
+
+
+def GetTransformer(source, target):
+    '''
+    This function is used to get the cached transformer between two projections,
+    the transformer is built only once for every pair of projections
+        source, target: the projections, for example 'EPSG:4326'
+        return the function which transforms the arrays of x and y (lon and lat
+            in degree) at once, and returns the transformed arrays
+    '''
+    
+    import pyproj
+    
+    transformer = _transformers.get((source, target))
+    if transformer is None:
+        try:
+            transformer = pyproj.Transformer.from_crs(source, target, always_xy=True).transform
+        except AttributeError:
+            # pyproj older than 2.1
+            from functools import partial
+            transformer = partial(pyproj.transform, pyproj.Proj(init=source), pyproj.Proj(init=target))
+        
+        _transformers[(source, target)] = transformer
+    
+    return transformer
+
+
+
+def MetricProjection(lon, lat, projection='mercator'):
+    '''
+    This function is used to choose the projection in meter used to sample a line
+        lon, lat: the coordinate of the line in WGS84, e.g. its first vertex
+        projection: 'mercator' to use the web mercator, EPSG:3857, its scale grows
+            with the latitude, for example 20 m in EPSG:3857 is only about 14 m on
+            the ground in Boston, or 'local' to use the UTM zone of the line, whose
+            scale error is less than 0.1%, or the polar azimuthal equidistant
+            projection beyond the UTM zones
+        return the (toMeter, toWGS84) transformers, see GetTransformer
+    '''
+    
+    if projection == 'mercator':
+        target = 'EPSG:3857'
+    elif projection == 'local':
+        if -80 <= lat < 84:
+            zone = min(int((lon + 180)//6) + 1, 60)
+            target = 'EPSG:%d'%((32600 if lat >= 0 else 32700) + zone)
+        else:
+            target = '+proj=aeqd +lat_0=%d +lon_0=0 +datum=WGS84 +units=m'%(90 if lat > 0 else -90)
+    else:
+        raise ValueError('Unknown projection: %s, use mercator or local'%(projection))
+    
+    return GetTransformer('EPSG:4326', target), GetTransformer(target, 'EPSG:4326')
+
+
+
+def SampleLine(coords, mini_dist, toMeter, toWGS84):
+    '''
+    This function is used to create points every mini_dist meters along a line,
+    the line is projected, interpolated and projected back as whole arrays
+        coords: the list of the (lon, lat) coordinates of the line in WGS84
+        mini_dist: the distance in meter between two created points
+        toMeter: the transformer from WGS84 to the projection in meter
+        toWGS84: the transformer from the projection in meter back to WGS84
+        return the arrays of the lon and lat of the points
+        raise ProjectionError if the coordinates are not in WGS84
+    '''
+    
+    import numpy as np
+    
+    coords = np.asarray(coords, dtype=np.float64)
+    if np.any(np.abs(coords[:, 0]) > 180) or np.any(np.abs(coords[:, 1]) > 90):
+        raise ProjectionError('The coordinates are not longitudes and latitudes in WGS84')
+    
+    x, y = toMeter(coords[:, 0], coords[:, 1])
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if not (np.all(np.isfinite(x)) and np.all(np.isfinite(y))):
+        raise ProjectionError('The coordinates can not be projected to meter')
+    
+    # the distance of every vertex from the start of the line
+    vertexDist = np.zeros(len(x))
+    np.cumsum(np.hypot(np.diff(x), np.diff(y)), out=vertexDist[1:])
+    
+    distances = np.arange(0, int(vertexDist[-1]), mini_dist)
+    if len(distances) == 0:
+        return distances, distances
+    
+    lon, lat = toWGS84(np.interp(distances, vertexDist, x), np.interp(distances, vertexDist, y))
+    
+    return np.asarray(lon), np.asarray(lat)
+
+
+
+# the types of the roads removed from the street map, the points are not created along the highways
+HIGHWAY_TYPES = {'trunk_link','tertiary','motorway','motorway_link','steps', None, ' ','pedestrian','primary', 'primary_link','footway','tertiary_link', 'trunk','secondary','secondary_link','tertiary_link','bridleway','service'}
+
+
+def CleanStreets(features, schema):
+    '''
+    This function is a generator, it removes the highways from the street features
+    one by one, nothing is kept in memory or written to the disk
+        features: the iterable of the fiona features of the street map
+        schema: the fiona schema of the street map
+        yield the features which are not highways
+    '''
+    
+    for feat in features:
+        try:
+            i = feat['properties']['highway'] # for the OSM street data
+        except:
+            # if the street map is not osm, do nothing. You'd better to clean the street map, if you don't want to map the GVI for highways
+            key = list(schema['properties'].keys())[0] # get the field of the input shapefile
+            i = feat['properties'][key]
+        
+        if i in HIGHWAY_TYPES:
+            continue
+        
+        yield feat
+
+
+
+def SampleStreets(features, mini_dist, projection='mercator'):
+    '''
+    This function is a generator, it creates the points every mini_dist meters
+    along the street features one by one
+        features: the iterable of the fiona features of the streets in WGS84
+        mini_dist: the distance in meter between two created points
+        projection: the projection used to measure the distance, see MetricProjection
+        yield the arrays of the lon and lat of the points of every line
+    '''
+    
+    from shapely.geometry import shape
+    
+    for line in features:
+        first = shape(line['geometry'])
+        
+        # every part of a multi line is sampled separately
+        parts = first.geoms if first.geom_type == 'MultiLineString' else [first]
+        for part in parts:
+            lon, lat = part.coords[0][:2]
+            toMeter, toWGS84 = MetricProjection(lon, lat, projection)
+            yield SampleLine(part.coords, mini_dist, toMeter, toWGS84)
+
+
+
+def SampleShard(inshp, start, end, mini_dist, projection='mercator'):
+    '''
+    This function is used to clean and sample the features from start to end of
+    the street map, it is run in the worker processes of createPoints
+        inshp: the input linear shapefile in WGS84
+        start, end: the range of the indexes of the features of the shard
+        mini_dist: the distance in meter between two created points
+        projection: the projection used to measure the distance, see MetricProjection
+        return the arrays of the lon and lat of the points of the shard, in the
+            order of the features, and the array of the number of the line of
+            every point in the shard
+    '''
+    
+    import fiona
+    import numpy as np
+    
+    lons = [np.zeros(0)]
+    lats = [np.zeros(0)]
+    lines = [np.zeros(0, dtype=np.int64)]
+    with fiona.open(inshp) as source:
+        for lineNum, (lon, lat) in enumerate(SampleStreets(CleanStreets(source.filter(start, end), source.schema), mini_dist, projection)):
+            lons.append(lon)
+            lats.append(lat)
+            lines.append(np.full(len(lon), lineNum, dtype=np.int64))
+    
+    return np.concatenate(lons), np.concatenate(lats), np.concatenate(lines)
+
+
+
+def SampleShards(inshp, shards, mini_dist, numWorkers=1, projection='mercator'):
+    '''
+    This function is a generator, it samples the shards of the street map in
+    numWorkers processes, and yields the points of the shards in the order of the
+    shards, at most 2*numWorkers shards are sampled or waiting at the same time
+        inshp: the input linear shapefile in WGS84
+        shards: the list of the (start, end) ranges of the indexes of the features
+        mini_dist: the distance in meter between two created points
+        numWorkers: the number of the worker processes, 1 to sample in this process
+        projection: the projection used to measure the distance, see MetricProjection
+        yield the arrays of the lon, lat and line number of the points of every shard, see SampleShard
+    '''
+    
+    from concurrent.futures import ProcessPoolExecutor
+    from collections import deque
+    
+    if numWorkers == 1:
+        for start, end in shards:
+            yield SampleShard(inshp, start, end, mini_dist, projection)
+        return
+    
+    with ProcessPoolExecutor(max_workers=numWorkers) as executor:
+        pending = deque()
+        for start, end in shards:
+            pending.append(executor.submit(SampleShard, inshp, start, end, mini_dist, projection))
+            if len(pending) >= 2*numWorkers:
+                yield pending.popleft().result()
+        
+        while pending:
+            yield pending.popleft().result()
+
+
+
+# the length of one degree on a great circle of the earth in meter
+METERS_PER_DEGREE = 111195.0
+
+
+class PointThinner(object):
+    '''
+    The spatial thinning of the sample points. The points created along
+    different lines at the intersections and on the shared or duplicated segments
+    are very close to each other, and every one of them costs a metadata request
+    and six GSV images. A point is removed when it is closer than mini_dist to a
+    point of another line already kept, the kept points are hashed in a grid of
+    mini_dist cells, so only the 9 cells around a point are checked
+
+        mini_dist: the minimum distance in meter between the points of different lines
+        projection: 'mercator' to measure the distance in EPSG:3857 like the sampling,
+            or 'local' to measure the distance on the ground, using the meters of
+            the degrees of longitude and latitude at the latitude of every point
+    '''
+
+    def __init__(self, mini_dist, projection='mercator'):
+        self.mini_dist = float(mini_dist)
+        self.projection = projection
+        self.grid = {}
+        self.removed = 0
+        self.toMeter = GetTransformer('EPSG:4326', 'EPSG:3857')
+
+    def thin(self, lon, lat, line):
+        '''
+        check the points in order, the kept points are added to the grid
+            lon, lat: the arrays of the coordinates of the points in WGS84
+            line: the array of the unique numbers of the lines of the points
+            return the boolean array, True for the points to keep
+        '''
+
+        import math
+        import numpy as np
+
+        if self.projection == 'mercator':
+            x, y = self.toMeter(lon, lat)
+        else:
+            # the local equirectangular projection, accurate for the distances of a few meters
+            x = lon*METERS_PER_DEGREE*np.cos(np.radians(lat))
+            y = lat*METERS_PER_DEGREE
+        d = self.mini_dist
+        d2 = d*d
+        grid = self.grid
+
+        keep = np.ones(len(lon), dtype=bool)
+        for idx, (px, py, pl) in enumerate(zip(np.asarray(x).tolist(), np.asarray(y).tolist(), np.asarray(line).tolist())):
+            cx = int(math.floor(px/d))
+            cy = int(math.floor(py/d))
+
+            near = False
+            for nx in (cx - 1, cx, cx + 1):
+                for ny in (cy - 1, cy, cy + 1):
+                    for qx, qy, ql in grid.get((nx, ny), ()):
+                        if ql != pl and (qx - px)**2 + (qy - py)**2 < d2:
+                            near = True
+                            break
+                    if near:
+                        break
+                if near:
+                    break
+
+            if near:
+                keep[idx] = False
+                self.removed += 1
+            else:
+                grid.setdefault((cx, cy), []).append((px, py, pl))
+
+        return keep
+
+
+
+def RemoveShapefile(shp):
+    '''
+    This function is used to remove a shapefile with all its sidecar files
+        shp: the file name of the .shp file
+    '''
+    
+    import os,os.path
+    
+    root = os.path.splitext(shp)[0]
+    for ext in ('.shp', '.shx', '.dbf', '.prj', '.cpg', '.qix', '.sbn', '.sbx'):
+        if os.path.exists(root + ext):
+            os.remove(root + ext)
+
+
+
 # now run the python file: createPoints.py, the input shapefile has to be in projection of WGS84, 4326
-def createPoints(inshp, outshp, mini_dist):
+def createPoints(inshp, outshp, mini_dist, numWorkers=1, shardSize=10000, thin=False, projection='mercator'):
     
     '''
     This function will parse throigh the street network of provided city and
     clean all highways and create points every mini_dist meters (or as specified) along
-    the linestrings
-    Required modules: Fiona and Shapely
+    the linestrings. The features are streamed from the input to the output in a
+    single pass, so the memory use doesn't grow with the size of the street network.
+    The features are split into shards of shardSize features, the shards are sampled
+    in numWorkers processes and merged in the order of the features, every point
+    gets the id of its order in the output, so the ids are the same with any
+    number of workers. If the input can not be projected, e.g. it is not in WGS84,
+    or the sampling fails with any other error, the partial output is removed, the
+    other errors are raised
+    Required modules: Fiona, Shapely, pyproj and numpy
 
     parameters:
         inshp: the input linear shapefile, must be in WGS84 projection, ESPG: 4326
         output: the result point feature class
         mini_dist: the minimum distance between two created point
+        numWorkers: the number of the worker processes, 1 to run in this process
+        shardSize: the number of the features in every shard
+        thin: if True, remove the points closer than mini_dist to a point of another
+            line, see PointThinner, the number of the removed points is reported
+        projection: the projection used to measure the distance, 'mercator' for the
+            web mercator, EPSG:3857, or 'local' for the UTM zone of every line so the
+            distance is the real distance on the ground, see MetricProjection
 
     last modified by Xiaojiang Li, MIT Senseable City Lab
     
     '''
     
     import fiona
-    import os,os.path
-    from shapely.geometry import shape,mapping
-    from shapely.ops import transform
-    from functools import partial
-    import pyproj
     from fiona.crs import from_epsg
     
     
-    count = 0
-    s = {'trunk_link','tertiary','motorway','motorway_link','steps', None, ' ','pedestrian','primary', 'primary_link','footway','tertiary_link', 'trunk','secondary','secondary_link','tertiary_link','bridleway','service'}
-    
-    # the temporaray file of the cleaned data
-    root = os.path.dirname(inshp)
-    basename = 'clean_' + os.path.basename(inshp)
-    temp_cleanedStreetmap = os.path.join(root,basename)
-    
-    # if the tempfile exist then delete it
-    if os.path.exists(temp_cleanedStreetmap):
-        fiona.remove(temp_cleanedStreetmap, 'ESRI Shapefile')
-    
-    # clean the original street maps by removing highways, if it the street map not from Open street data, users'd better to clean the data themselve
-    with fiona.open(inshp) as source, fiona.open(temp_cleanedStreetmap, 'w', driver=source.driver, crs=source.crs,schema=source.schema) as dest:
-        
-        for feat in source:
-            try:
-                i = feat['properties']['highway'] # for the OSM street data
-                if i in s:
-                    continue
-            except:
-                # if the street map is not osm, do nothing. You'd better to clean the street map, if you don't want to map the GVI for highways
-                key = dest.schema['properties'].keys()[0] # get the field of the input shapefile and duplicate the input feature
-                i = feat['properties'][key]
-                if i in s:
-                    continue
-            
-            dest.write(feat)
-
     schema = {
         'geometry': 'Point',
         'properties': {'id': 'int'},
     }
 
-    # Create pointS along the streets
-    with fiona.drivers():
-        #with fiona.open(outshp, 'w', 'ESRI Shapefile', crs=source.crs, schema) as output:
-        with fiona.open(outshp, 'w', crs = from_epsg(4326), driver = 'ESRI Shapefile', schema = schema) as output:
-            for line in fiona.open(temp_cleanedStreetmap):
-                first = shape(line['geometry'])
-                
-                length = first.length
-                
-                try:
-                    # convert degree to meter, in order to split by distance in meter
-                    project = partial(pyproj.transform,pyproj.Proj(init='EPSG:4326'),pyproj.Proj(init='EPSG:3857')) #3857 is psudo WGS84 the unit is meter
+    # check the projection before sampling
+    MetricProjection(0, 0, projection)
+    
+    # the shards of the indexes of the features
+    with fiona.open(inshp) as source:
+        featureNum = len(source)
+    shards = [(start, min(start + shardSize, featureNum)) for start in range(0, featureNum, shardSize)]
+    
+    thinner = PointThinner(mini_dist, projection) if thin else None
+    
+    # Create pointS along the streets, the streets are cleaned and sampled in one pass without temporary file
+    try:
+        with fiona.Env():
+            #with fiona.open(outshp, 'w', crs=source.crs, schema) as output:
+            with fiona.open(outshp, 'w', crs = from_epsg(4326), driver = 'ESRI Shapefile', schema = schema) as output:
+                pntNum = 0
+                lineNum = 0
+                for lon, lat, line in SampleShards(inshp, shards, mini_dist, numWorkers, projection):
+                    # the line numbers of the shard start after the lines of the earlier shards
+                    line = line + lineNum
+                    if len(line):
+                        lineNum = int(line.max()) + 1
                     
-                    line2 = transform(project, first)
-                    linestr = list(line2.coords)
-                    dist = mini_dist #set
-                    for distance in range(0,int(line2.length), dist):
-                        point = line2.interpolate(distance)
-                        
-                        # convert the local projection back the the WGS84 and write to the output shp
-                        project2 = partial(pyproj.transform,pyproj.Proj(init='EPSG:3857'),pyproj.Proj(init='EPSG:4326'))
-                        point = transform(project2, point)
-                        output.write({'geometry':mapping(point),'properties': {'id':1}})
-                except:
-                    print ("You should make sure the input shapefile is WGS84")
-                    return
+                    if thinner is not None:
+                        keep = thinner.thin(lon, lat, line)
+                        lon = lon[keep]
+                        lat = lat[keep]
                     
-    print("Process Complete")
+                    # write all the points of the shard to the output shp at once
+                    output.writerecords([{'geometry': {'type': 'Point', 'coordinates': (x, y)}, 'properties': {'id': pntNum + idx}}
+                                         for idx, (x, y) in enumerate(zip(lon.tolist(), lat.tolist()))])
+                    pntNum += len(lon)
+    except ProjectionErrors():
+        RemoveShapefile(outshp)
+        print ("You should make sure the input shapefile is WGS84")
+        return
+    except:
+        # the truncated output is removed, so it is not taken as the points of the whole street map
+        RemoveShapefile(outshp)
+        raise
+    
+    if thinner is not None:
+        print ('%s redundant points are removed, saving %s metadata requests and %s GSV images'%(thinner.removed, thinner.removed, 6*thinner.removed))
     
-    # delete the temprary cleaned shapefile
-    fiona.remove(temp_cleanedStreetmap, 'ESRI Shapefile')
+    print("Process Complete")
 
 
 # Example to use the code, 
@@ -109,6 +422,7 @@ if __name__ == "__main__":
     inshp = os.path.join(root,'CambridgeStreet_wgs84.shp')
     outshp = os.path.join(root,'Cambridge20m.shp')
     mini_dist = 20 #the minimum distance between two generated points in meter
-    createPoints(inshp, outshp, mini_dist)
+    projection = 'local' # measure mini_dist on the ground, 'mercator' for the points of the earlier versions
+    createPoints(inshp, outshp, mini_dist, projection=projection)
 
 
@@ -0,0 +1,122 @@
+# This program provides the file lock and the atomic file writing shared by the processes of
+# the Treepedia pipeline, for example several processes of GreenView_Calculate.py working on the
+# same folder at the same time
+
+# Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT
+
+import os,os.path
+import threading
+
+
+class FileLock(object):
+    '''
+    An exclusive lock shared by the threads and the processes using the same lock
+    file, use it in the with statement
+
+        with FileLock('/path/to/state.json.lock'):
+            ...
+
+    or call acquire(blocking=False) to try to get the lock without waiting. The
+    lock is released by the operating system when the process dies
+
+        lockFile: the file name of the lock file, it is created if it doesn't exist
+    '''
+
+    # the states of the lock files in this process, shared by all the FileLock objects of the same file
+    _states = {}
+    _statesLock = threading.Lock()
+
+    def __init__(self, lockFile):
+        self.lockFile = os.path.abspath(lockFile)
+        with FileLock._statesLock:
+            self.state = FileLock._states.setdefault(self.lockFile, {'lock': threading.RLock(), 'depth': 0, 'handle': None})
+
+    def acquire(self, blocking=True):
+        '''
+        get the lock, return False if blocking is False and the lock is held by
+        another thread or process
+        '''
+
+        state = self.state
+        if not state['lock'].acquire(blocking):
+            return False
+
+        if state['depth'] == 0:
+            handle = open(self.lockFile, 'a+')
+            try:
+                try:
+                    import fcntl
+                    flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+                    fcntl.flock(handle.fileno(), flags)
+                except ImportError:
+                    import msvcrt
+                    handle.seek(0)
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            except (IOError, OSError):
+                handle.close()
+                state['lock'].release()
+                if blocking:
+                    raise
+                return False
+
+            state['handle'] = handle
+
+        state['depth'] += 1
+        return True
+
+    def release(self):
+        '''release the lock'''
+
+        state = self.state
+        state['depth'] -= 1
+        if state['depth'] == 0:
+            handle = state['handle']
+            try:
+                import fcntl
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+            except ImportError:
+                import msvcrt
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+            handle.close()
+            state['handle'] = None
+
+        state['lock'].release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+
+def atomicWrite(fileName, data):
+    '''
+    This function is used to write a file atomically, the data is written to a
+    temporary file in the same folder and then renamed to the file name, so the
+    other processes see either the old file or the complete new file
+
+        fileName: the file name
+        data: the bytes or the string to write
+    '''
+
+    import tempfile
+
+    folder = os.path.dirname(os.path.abspath(fileName))
+    mode = 'wb' if isinstance(data, bytes) else 'w'
+
+    fd, tempFile = tempfile.mkstemp(dir=folder, prefix='.tmp_')
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tempFile, fileName)
+    except:
+        if os.path.exists(tempFile):
+            os.remove(tempFile)
+        raise
+
@@ -0,0 +1,534 @@
+# This program is the concurrent pipeline used to download and classify the GSV images in the
+# green view index calculation (GreenView_Calculate.py). A bounded pool of fetcher threads downloads
+# the images of the panoramas and puts the decoded images in a bounded queue, and a pool of
+# classifier processes takes the images from the queue and classifies them. When the classifiers
+# can not keep up, the queue is full and the fetchers wait, so the memory doesn't grow without
+# limit. The speed of the downloading is limited by the token buckets of the API keys, see
+# keyScheduler.py. An image which can not be downloaded only loses its own heading, the other
+# headings of the panorama are still classified. The images of the headings can also be cut out of
+# the equirectangular image of the whole panorama, downloaded with one request, see
+# panoramaProjection.py. The images are written into the preallocated slots of an image ring and
+# read by the classifiers in place, see imageRing.py.
+
+# Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT
+
+import threading
+
+import queue
+
+try:
+    from .keyScheduler import KeyScheduler, QuotaExceeded
+    from .imageCache import ImageCacheKey
+    from .panoramaProjection import ReprojectPanorama
+    from .imageRing import ImageRing, ClassifySlot
+except (ImportError, ValueError):
+    from keyScheduler import KeyScheduler, QuotaExceeded
+    from imageCache import ImageCacheKey
+    from panoramaProjection import ReprojectPanorama
+    from imageRing import ImageRing, ClassifySlot
+
+
+# the URL of the Google Street View Static API
+GSV_IMAGE_URL = 'http://maps.googleapis.com/maps/api/streetview'
+
+# the URL of the tiles of the equirectangular GSV panoramas
+GSV_PANORAMA_URL = 'http://cbk0.google.com/cbk'
+
+
+def GSVImageURL(panoID, heading, pitch, key, size='400x400', fov=60, baseURL=GSV_IMAGE_URL):
+    '''
+    This function is used to get the URL of the GSV image of a panorama
+        panoID: the id of the panorama
+        heading, pitch: the heading and pitch of the camera in degree
+        key: the Google Street View API key
+        size: the size of the image, widthxheight
+        fov: the horizontal field of view of the image in degree
+        baseURL: the URL of the Street View Static API, or of a local server for testing
+        return the URL
+    '''
+
+    return '%s?size=%s&pano=%s&fov=%d&heading=%d&pitch=%d&sensor=false&key=%s'%(baseURL, size, panoID, fov, heading, pitch, key)
+
+
+
+def DownloadGSVImage(session, URL):
+    '''
+    This function is used to download the GSV image
+        session: the requests session used to download the image
+        URL: the URL of the GSV image
+        return the bytes of the jpg image
+    '''
+
+    response = session.get(URL, timeout=30)
+    response.raise_for_status()
+
+    return response.content
+
+
+
+def DecodeGSVImage(data, out=None, scale=1):
+    '''
+    This function is used to decode the GSV image, the bytes are read in place,
+    and the image can be decoded into a preallocated array, e.g. a slot of the
+    ImageRing, instead of a new array
+        data: the bytes of the jpg image
+        out: the uint8 numpy array in shape of (H/scale, W/scale, 3) to store the
+            image, None to create a new array
+        scale: 1, 2, 4 or 8, the jpg image is decoded at 1/scale of its size by the
+            draft mode of PIL, which skips most of the work of the decoding, so
+            the green view index can be approximated much faster
+        return the numpy array image, uint8 in shape of (H/scale, W/scale, 3)
+    '''
+
+    from io import BytesIO
+    from PIL import Image
+    import numpy as np
+
+    # BytesIO shares the memory of the bytes until it is written
+    img = Image.open(BytesIO(data))
+
+    if scale > 1:
+        size = (img.size[0]//scale, img.size[1]//scale)
+        img.draft('RGB', size)
+
+        # the draft mode only works on the jpg images
+        if img.size != size:
+            img = img.resize(size)
+
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    if out is None:
+        return np.array(img)
+
+    if out.shape != (img.size[1], img.size[0], 3):
+        raise ValueError('The image in size of %sx%s does not fit the array in shape of %s'%(img.size + (out.shape,)))
+    out[...] = np.asarray(img)
+
+    return out
+
+
+
+def GetGSVImage(session, scheduler, panoID, heading, pitch, cache=None, size='400x400', fov=60, baseURL=GSV_IMAGE_URL):
+    '''
+    This function is used to get the GSV image from the image cache, or download
+    it when it is not in the cache, the cached images don't use the API keys
+        session: the requests session used to download the image
+        scheduler: the KeyScheduler giving the API key of the request
+        panoID: the id of the panorama
+        heading, pitch: the heading and pitch of the camera in degree
+        cache: the image cache, see imageCache.py, None to always download
+        size, fov, baseURL: see GSVImageURL
+        return the bytes of the jpg image
+    '''
+
+    if cache is not None:
+        cacheKey = ImageCacheKey(panoID, heading, pitch, fov, size)
+        data = cache.get(cacheKey)
+        if data is not None:
+            return data
+
+    key = scheduler.acquire()
+    data = DownloadGSVImage(session, GSVImageURL(panoID, heading, pitch, key, size, fov, baseURL))
+
+    if cache is not None:
+        cache.put(cacheKey, data)
+
+    return data
+
+
+
+def GSVPanoramaURL(panoID, zoom, key=None, x=None, y=None, baseURL=GSV_PANORAMA_URL):
+    '''
+    This function is used to get the URL of the equirectangular image of a panorama
+        panoID: the id of the panorama
+        zoom: the zoom level of the panorama, the width of the panorama is 512*2**zoom
+        key: the Google Street View API key, None for the tiles, which need no key
+        x, y: the column and the row of the tile, None for the whole panorama, the
+            whole panorama is only served by a local server, e.g. for testing
+        baseURL: the URL of the panoramas
+        return the URL
+    '''
+
+    if x is None:
+        URL = '%s?output=panorama&panoid=%s&zoom=%d'%(baseURL, panoID, zoom)
+    else:
+        URL = '%s?output=tile&panoid=%s&zoom=%d&x=%d&y=%d'%(baseURL, panoID, zoom, x, y)
+
+    if key is not None:
+        URL += '&key=%s'%(key)
+
+    return URL
+
+
+
+def PanoramaScheduler(scheduler):
+    '''
+    This function is used to get the scheduler of the panorama requests, the tiles
+    and the yaws of the panoramas need no API key, so they don't use the daily quota
+    of the keys, but they are sent at most at the total rate of all the keys. The
+    counters are saved next to the state file of the keys, so all the processes
+    sharing the keys share the rate
+        scheduler: the KeyScheduler of the API keys
+        return the KeyScheduler of the panorama requests
+    '''
+
+    import os.path
+
+    stateFile = None
+    if scheduler.stateFile is not None:
+        stateFile = '%s_panorama%s'%os.path.splitext(scheduler.stateFile)
+
+    return KeyScheduler(['panorama'], scheduler.rate*len(scheduler.keylist), float('inf'), stateFile, scheduler.burst)
+
+
+
+def GetGSVPanorama(session, scheduler, panoID, zoom=3, tiles=None, cache=None, baseURL=GSV_PANORAMA_URL, scale=1):
+    '''
+    This function is used to get the equirectangular image of a panorama, from the
+    image cache, or downloaded as one image or as a mosaic of tiles
+        session: the requests session used to download the image
+        scheduler: the KeyScheduler limiting the rate of the requests, see
+            PanoramaScheduler, the panoramas are requested without API key
+        panoID: the id of the panorama
+        zoom: the zoom level of the panorama
+        tiles: the (columns, rows) of the tiles of the panorama, None to download
+            the panorama with one request
+        cache: the image cache, see imageCache.py, None to always download
+        baseURL: see GSVPanoramaURL
+        scale: the panorama is decoded at 1/scale of its size, see DecodeGSVImage
+        return the numpy array of the panorama, uint8 in shape of (H, W, 3)
+    '''
+
+    import numpy as np
+
+    if tiles is None:
+        positions = [(None, None)]
+    else:
+        positions = [(x, y) for y in range(tiles[1]) for x in range(tiles[0])]
+
+    # the tiles are cached as the images of the heading x and the pitch y, of the server, the zoom
+    # and the tiles of the panorama
+    size = 'panorama|%s|%d|%s'%(baseURL, zoom, 'whole' if tiles is None else '%dx%d'%tuple(tiles))
+
+    imgs = []
+    for x, y in positions:
+        cacheKey = ImageCacheKey(panoID, -1 if x is None else x, -1 if y is None else y, 360, size)
+        data = None if cache is None else cache.get(cacheKey)
+        if data is None:
+            scheduler.acquire()
+            data = DownloadGSVImage(session, GSVPanoramaURL(panoID, zoom, None, x, y, baseURL))
+            if cache is not None:
+                cache.put(cacheKey, data)
+
+        imgs.append(DecodeGSVImage(data, scale=scale))
+
+    if tiles is None:
+        return imgs[0]
+
+    rows = [np.concatenate(imgs[y*tiles[0]:(y + 1)*tiles[0]], axis=1) for y in range(tiles[1])]
+
+    return np.concatenate(rows, axis=0)
+
+
+
+def CheckPanoramaOptions(panoramaZoom, panoramaTiles, panoramaURL, panoramaYaw):
+    '''
+    This function is used to check the panorama options of GreenViewPipeline before
+    any request, raise ValueError if the images of the headings can not be cut out
+    of the panoramas correctly
+    '''
+
+    if panoramaZoom is None:
+        return
+
+    # GSV only serves the tiles, the whole panoramas are only served by a local server
+    if panoramaTiles is None and panoramaURL == GSV_PANORAMA_URL:
+        raise ValueError('The GSV panoramas are only served as tiles, give panoramaTiles, or the panoramaURL of your server')
+
+    # the images cut out of the GSV tiles without their yaw would get the wrong headings
+    if panoramaTiles is not None and panoramaYaw is None:
+        raise ValueError('The GSV panorama tiles are centred on the heading of the car, give panoramaYaw')
+
+
+
+def GreenViewPipeline(panoLst, scheduler, classify, headingArr, pitch=0,
+                      numFetchers=8, numClassifiers=None, queueSize=16, cache=None, baseURL=GSV_IMAGE_URL,
+                      panoramaZoom=None, panoramaTiles=None, panoramaURL=GSV_PANORAMA_URL, draftScale=1,
+                      imageSize=400, panoramaYaw=None):
+    '''
+    This function is a generator, it downloads the GSV images of the panoramas
+    in fetcher threads and classifies the images of every panorama in classifier
+    processes, the results are yielded in the order they are finished
+
+    Parameters:
+        panoLst: the list of the panoramas, every panorama is a tuple which starts
+            with the panoID, e.g. (panoID, panoDate, lon, lat)
+        scheduler: the KeyScheduler giving the API key of every request
+        classify: the function which takes the (N, H, W, 3) stack of the N images
+            of a panorama and returns the N results, e.g. the green percentages, it
+            runs in the classifier processes so it has to be a module level function
+        headingArr: the heading angles of the images of every panorama
+        pitch: the pitch angle of the images
+        numFetchers: the number of the fetcher threads
+        numClassifiers: the number of the classifier processes, the number of
+            cpus by default, 0 to classify the images in this process, e.g. when
+            the pipeline runs in a worker process of the work queue
+        queueSize: the number of the downloaded panoramas waiting in the queue,
+            the fetchers wait when the queue is full
+        cache: the image cache, the images in the cache are not downloaded again
+        baseURL: the URL of the Street View Static API, or of a local server for testing
+        panoramaZoom: the zoom level of the equirectangular panoramas, if it is given,
+            every panorama is downloaded once and the images of the headings are cut
+            out of the panorama, see panoramaProjection.py, None to request the image
+            of every heading from the Street View Static API
+        panoramaTiles: the (columns, rows) of the tiles of the panoramas, None to
+            download every panorama with one request, see GetGSVPanorama. The GSV
+            tiles are centred on the heading of the capture car, so panoramaYaw
+            has to be given with panoramaTiles
+        panoramaURL: the URL of the panoramas, see GSVPanoramaURL, the whole panoramas
+            without panoramaTiles are only served by a local server
+        draftScale: 1, 2, 4 or 8, the images are decoded at 1/draftScale of their
+            size, see DecodeGSVImage, the classify function has to be independent
+            of the size of the images
+        imageSize: the width and height of the images in pixel, the Street View
+            Static API gives the images up to 640x640
+        panoramaYaw: the function which takes the requests session, the scheduler
+            of the panorama requests (see PanoramaScheduler) and the panoID and
+            returns the heading in degree of the center column of the panorama,
+            e.g. FetchPanoramaYaw in metadataCollector.py, None for the panoramas
+            whose center column faces north, e.g. of a local server, see ReprojectPanorama
+
+    yield (pano, results), results is the list of the results of classify of every
+        heading, None for the headings which can not be downloaded, or None if no
+        image of the panorama can be downloaded, or the images can not be classified
+    raise QuotaExceeded when all the keys have used up the daily quota, the
+        panoramas not yielded yet are not processed
+    raise ValueError if the panorama options can not work, see CheckPanoramaOptions
+    '''
+
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    import multiprocessing
+    import requests
+
+    if numClassifiers is None:
+        numClassifiers = multiprocessing.cpu_count()
+
+    CheckPanoramaOptions(panoramaZoom, panoramaTiles, panoramaURL, panoramaYaw)
+
+    # the panorama requests need no key, they are only limited by the rate of the keys
+    panoramaScheduler = None if panoramaZoom is None else PanoramaScheduler(scheduler)
+
+    # the panoramas waiting to be downloaded, and the downloaded images waiting to be classified
+    taskQueue = queue.Queue()
+    for pano in panoLst:
+        taskQueue.put(pano)
+
+    imageQueue = queue.Queue(maxsize=queueSize)
+    stop = threading.Event()
+    closed = threading.Event()
+    errors = []
+
+    # the slots of the images waiting in the queue, being downloaded and being classified, in
+    # shared memory when the classifiers are other processes
+    numSlots = queueSize + numFetchers + max(2*numClassifiers, 1)
+    size = (imageSize//draftScale, imageSize//draftScale)
+    ring = ImageRing(numSlots, (len(headingArr), size[1], size[0], 3), shared=numClassifiers > 0)
+
+    # download the images of a panorama into the slot, return the images and the indexes of their headings
+    def fetchPano(session, pano, slot):
+        if panoramaZoom is not None:
+            try:
+                panorama = GetGSVPanorama(session, panoramaScheduler, pano[0], panoramaZoom, panoramaTiles, cache,
+                                          panoramaURL, draftScale)
+                panoYaw = 0 if panoramaYaw is None else panoramaYaw(session, panoramaScheduler, pano[0])
+
+            except QuotaExceeded:
+                raise
+
+            except Exception as e:
+                print('Failed to download the panorama %s: %s'%(pano[0], e))
+                return None, []
+
+            return (ReprojectPanorama(panorama, headingArr, pitch, size, out=slot, panoYaw=panoYaw),
+                    list(range(len(headingArr))))
+
+        valid = []
+        for n, heading in enumerate(headingArr):
+            try:
+                data = GetGSVImage(session, scheduler, pano[0], heading, pitch, cache, '%dx%d'%(imageSize, imageSize),
+                                   baseURL=baseURL)
+                DecodeGSVImage(data, out=slot[len(valid)], scale=draftScale)
+                valid.append(n)
+
+            except QuotaExceeded:
+                raise
+
+            # if the GSV image is not download successfully, only this heading is lost
+            except Exception as e:
+                print('Failed to download the heading %s of the pano %s: %s'%(heading, pano[0], e))
+
+                # the panorama doesn't exist, the other headings are not requested
+                status = getattr(getattr(e, 'response', None), 'status_code', None)
+                if status is not None and 400 <= status < 500 and status != 429:
+                    break
+
+        if not valid:
+            return None, valid
+
+        return slot[:len(valid)], valid
+
+    # put the item into the queue, give up when the generator is closed and nobody takes it anymore
+    def putItem(item):
+        while not closed.is_set():
+            try:
+                imageQueue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def fetcher():
+        session = requests.Session()
+        while not stop.is_set():
+            try:
+                pano = taskQueue.get_nowait()
+            except queue.Empty:
+                break
+
+            # wait for a free slot, the classifiers give the slots back
+            index = ring.acquire(stop)
+            if index is None:
+                break
+
+            try:
+                imgs, valid = fetchPano(session, pano, ring.slot(index))
+
+            # stop all the fetchers when the keys have used up the quota
+            except QuotaExceeded as e:
+                ring.release(index)
+                errors.append(e)
+                stop.set()
+                break
+
+            except Exception as e:
+                print('Failed to download the pano %s: %s'%(pano[0], e))
+                imgs, valid = None, []
+
+            if imgs is None:
+                ring.release(index)
+                index = None
+
+            putItem((pano, index, valid))
+
+        session.close()
+        putItem(None)
+
+    # stop the fetchers, also the ones waiting for the full queue when the generator is closed early,
+    # and wait for the downloads in progress, so no image is written into the ring after it is freed
+    def closePipeline():
+        closed.set()
+        stop.set()
+        while True:
+            try:
+                imageQueue.get_nowait()
+            except queue.Empty:
+                break
+
+        for thread in fetchers:
+            thread.join()
+
+    # the list of the results of all the headings, None for the headings not downloaded
+    def headingResults(results, valid):
+        headingResults = [None]*len(headingArr)
+        for n, result in zip(valid, results):
+            headingResults[n] = result
+
+        return headingResults
+
+    fetchers = [threading.Thread(target=fetcher) for n in range(numFetchers)]
+    for thread in fetchers:
+        thread.daemon = True
+        thread.start()
+
+    # classify the images in this process, one panorama at a time
+    if numClassifiers == 0:
+        try:
+            numRunning = numFetchers
+            while numRunning > 0:
+                item = imageQueue.get()
+                if item is None:
+                    numRunning -= 1
+                    continue
+
+                pano, index, valid = item
+                results = None
+                if index is not None:
+                    try:
+                        results = headingResults(classify(ring.slot(index)[:len(valid)]), valid)
+                    except Exception as e:
+                        print('Failed to classify the pano %s: %s'%(pano[0], e))
+                    ring.release(index)
+
+                yield pano, results
+
+            if errors:
+                raise errors[0]
+
+        finally:
+            closePipeline()
+            ring.close()
+
+        return
+
+    executor = ProcessPoolExecutor(max_workers=numClassifiers)
+    pending = {}
+
+    try:
+        numRunning = numFetchers
+        while numRunning > 0 or pending:
+            # only take the next images when the classifiers are not all busy
+            canTake = numRunning > 0 and len(pending) < 2*numClassifiers
+
+            # yield the finished panoramas, only wait for them when no images can be taken
+            done, notDone = wait(pending, timeout=0 if canTake else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                pano, index, valid = pending.pop(future)
+                try:
+                    results = headingResults(future.result(), valid)
+                except Exception as e:
+                    print('Failed to classify the pano %s: %s'%(pano[0], e))
+                    results = None
+                ring.release(index)
+
+                yield pano, results
+
+            if done or not canTake:
+                continue
+
+            # wait for the next images, only briefly while the classifiers are running, so the
+            # finished panoramas are yielded without waiting for the fetchers
+            try:
+                item = imageQueue.get(timeout=0.01 if pending else None)
+            except queue.Empty:
+                continue
+
+            if item is None:
+                numRunning -= 1
+                continue
+
+            pano, index, valid = item
+            if index is None:
+                yield pano, None
+            else:
+                # only the index of the slot in the shared memory is sent to the classifier
+                future = executor.submit(ClassifySlot, classify, ring.name, ring.numSlots, ring.slotShape,
+                                         index, len(valid))
+                pending[future] = (pano, index, valid)
+
+        if errors:
+            raise errors[0]
+
+    finally:
+        closePipeline()
+        executor.shutdown(wait=True)
+        ring.close()
@@ -0,0 +1,331 @@
+# This program is the local cache of the downloaded GSV images. The images are addressed by the
+# hash of the request parameters (panoID, heading, pitch, fov, size), so rerunning the green view
+# calculation, for example after changing the green months or tuning the thresholds, reads the
+# images from the disk instead of downloading them again.
+
+# Two kinds of storage are provided, both of them are capped in size with a least recently used
+# eviction, and can be shared by several processes:
+# FileImageCache: every image is a jpg file, written atomically
+# PackedImageCache: the images are appended to large pack files and read by memory mapping, the
+#                   index is a sqlite database, so millions of images don't use millions of inodes
+
+# Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT
+
+import os,os.path
+import threading
+
+try:
+    from .fileLock import FileLock, atomicWrite
+except (ImportError, ValueError):
+    from fileLock import FileLock, atomicWrite
+
+
+def ImageCacheKey(panoID, heading, pitch, fov=60, size='400x400'):
+    '''
+    This function is used to get the cache key of a GSV image request
+        panoID: the id of the panorama
+        heading, pitch: the heading and pitch of the camera in degree
+        fov: the horizontal field of view of the image in degree
+        size: the size of the image, widthxheight
+        return the sha1 hex digest of the request parameters
+    '''
+
+    import hashlib
+
+    request = '%s|%d|%d|%d|%s'%(panoID, heading, pitch, fov, size)
+
+    return hashlib.sha1(request.encode('utf-8')).hexdigest()
+
+
+
+class FileImageCache(object):
+    '''
+    The image cache storing every image as a jpg file in folder/ab/cdef...jpg,
+    ab is the first two letters of the key. The files are written atomically, the
+    modification time of a file is updated when it is read, and the least recently
+    used files are removed when the total size is over maxBytes. The total size is
+    kept in the size file of the folder, updated under the file lock, so all the
+    processes sharing the cache count against the same maxBytes
+
+        folder: the folder of the cache
+        maxBytes: the maximum total size of the images in byte
+    '''
+
+    def __init__(self, folder, maxBytes=10*2**30):
+        self.folder = folder
+        self.maxBytes = maxBytes
+        self.sizeFile = os.path.join(folder, 'size')
+        self.lock = FileLock(os.path.join(folder, 'evict.lock'))
+
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def _path(self, key):
+        return os.path.join(self.folder, key[:2], key[2:] + '.jpg')
+
+    def get(self, key):
+        '''return the bytes of the cached image, None if it is not in the cache'''
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+
+        return data
+
+    def put(self, key, data):
+        '''save the bytes of the image in the cache'''
+
+        path = self._path(key)
+        subFolder = os.path.dirname(path)
+        if not os.path.exists(subFolder):
+            try:
+                os.makedirs(subFolder)
+            except OSError:
+                pass
+
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+
+        atomicWrite(path, data)
+
+        with self.lock:
+            size = self._readSize()
+            if size is None:
+                size = self._scan()[1]
+            else:
+                size += len(data) - replaced
+
+            if size > self.maxBytes:
+                self.evict()
+            else:
+                self._writeSize(size)
+
+    def _readSize(self):
+        '''the total size in the size file, None if it is missing or broken'''
+
+        try:
+            with open(self.sizeFile, 'r') as f:
+                return int(f.read())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _writeSize(self, size):
+        '''write the total size, the size file is only used under the lock, a broken file is counted again'''
+
+        with open(self.sizeFile, 'w') as f:
+            f.write('%d'%(size))
+
+    def _scan(self):
+        '''return the list of (mtime, size, path) of the cached images, and the total size'''
+
+        files = []
+        total = 0
+        for root, dirs, fileNames in os.walk(self.folder):
+            for fileName in fileNames:
+                if not fileName.endswith('.jpg'):
+                    continue
+
+                path = os.path.join(root, fileName)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        return files, total
+
+    def evict(self):
+        '''remove the least recently used images until the total size is 90% of maxBytes'''
+
+        with self.lock:
+            files, total = self._scan()
+            files.sort()
+
+            for mtime, size, path in files:
+                if total <= 0.9*self.maxBytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+            self._writeSize(total)
+
+
+
+class PackedImageCache(object):
+    '''
+    The image cache appending the images to pack files of segmentBytes, the pack
+    files are read by memory mapping. The index of the images is a sqlite database,
+    an image is only added to the index after it is written completely, so an
+    interrupted writing never leaves a broken image in the cache. The images can
+    not be removed one by one from the pack files, when the total size is over
+    maxBytes, the pack files used least recently are removed as a whole. The access
+    time of an image is only written when it is older than atimeResolution, so
+    reading the cached images doesn't write the index on every hit
+
+        folder: the folder of the cache
+        maxBytes: the maximum total size of the pack files in byte
+        segmentBytes: the size of every pack file in byte
+        atimeResolution: the time in second before the access time of an image is
+            updated again
+    '''
+
+    def __init__(self, folder, maxBytes=10*2**30, segmentBytes=256*2**20, atimeResolution=600):
+        self.folder = folder
+        self.maxBytes = maxBytes
+        self.segmentBytes = segmentBytes
+        self.atimeResolution = atimeResolution
+        self.local = threading.local()
+        self.maps = {}
+        self.mapsLock = threading.Lock()
+
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.packLock = FileLock(os.path.join(folder, 'pack.lock'))
+
+        db = self._db()
+        with db:
+            db.execute('CREATE TABLE IF NOT EXISTS images (key TEXT PRIMARY KEY, segment INTEGER, '
+                       'offset INTEGER, length INTEGER, atime REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS images_segment ON images (segment)')
+
+    def _db(self):
+        '''the sqlite connection of this thread'''
+
+        import sqlite3
+
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(os.path.join(self.folder, 'index.sqlite'), timeout=60)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+
+        return db
+
+    def _segmentPath(self, segment):
+        return os.path.join(self.folder, 'pack_%06d.bin'%(segment))
+
+    def _read(self, segment, offset, length):
+        '''read the bytes from the memory map of the pack file, it is mapped again if the file has grown'''
+
+        import mmap
+
+        with self.mapsLock:
+            mm = self.maps.get(segment)
+            if mm is None or len(mm) < offset + length:
+                if mm is not None:
+                    mm.close()
+                with open(self._segmentPath(segment), 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.maps[segment] = mm
+
+            return mm[offset:offset + length]
+
+    def get(self, key):
+        '''return the bytes of the cached image, None if it is not in the cache'''
+
+        import time
+
+        db = self._db()
+        row = db.execute('SELECT segment, offset, length, atime FROM images WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+
+        segment, offset, length, atime = row
+        try:
+            data = self._read(segment, offset, length)
+        except (IOError, OSError, ValueError):
+            return None
+
+        # the whole pack files are evicted, a coarse access time is enough to choose them
+        now = time.time()
+        if now - atime > self.atimeResolution:
+            with db:
+                db.execute('UPDATE images SET atime = ? WHERE key = ?', (now, key))
+
+        return data
+
+    def put(self, key, data):
+        '''append the bytes of the image to the current pack file and add it to the index'''
+
+        import time
+
+        db = self._db()
+        with self.packLock:
+            segments = self._segments()
+            segment = segments[-1] if segments else 0
+            path = self._segmentPath(segment)
+            if os.path.exists(path) and os.path.getsize(path) + len(data) > self.segmentBytes:
+                segment += 1
+                path = self._segmentPath(segment)
+
+            with open(path, 'ab') as f:
+                offset = f.tell()
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+
+            with db:
+                db.execute('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?)',
+                           (key, segment, offset, len(data), time.time()))
+
+            total = sum(os.path.getsize(self._segmentPath(s)) for s in self._segments())
+            if total > self.maxBytes:
+                self._evict(total, segment)
+
+    def _segments(self):
+        '''the sorted numbers of the pack files'''
+
+        return sorted(int(f[5:11]) for f in os.listdir(self.folder) if f.startswith('pack_') and f.endswith('.bin'))
+
+    def _evict(self, total, current):
+        '''remove the least recently used pack files, except the current one, until the total size is 90% of maxBytes'''
+
+        db = self._db()
+        lastUsed = dict(db.execute('SELECT segment, MAX(atime) FROM images GROUP BY segment').fetchall())
+        candidates = sorted((lastUsed.get(s, 0), s) for s in self._segments() if s != current)
+
+        for atime, segment in candidates:
+            if total <= 0.9*self.maxBytes:
+                break
+
+            with db:
+                db.execute('DELETE FROM images WHERE segment = ?', (segment,))
+
+            path = self._segmentPath(segment)
+            total -= os.path.getsize(path)
+            os.remove(path)
+
+            with self.mapsLock:
+                mm = self.maps.pop(segment, None)
+                if mm is not None:
+                    mm.close()
+
+
+
+def OpenImageCache(folder, maxBytes=10*2**30, packed=False):
+    '''
+    This function is used to open the image cache
+        folder: the folder of the cache
+        maxBytes: the maximum total size of the cache in byte
+        packed: if True, use the PackedImageCache, otherwise the FileImageCache
+        return the image cache
+    '''
+
+    if packed:
+        return PackedImageCache(folder, maxBytes)
+    else:
+        return FileImageCache(folder, maxBytes)
+
@@ -0,0 +1,134 @@
+# This program is the ring of the preallocated image slots used by the GreenViewPipeline to hand
+# the downloaded images to the classifiers. Every slot holds the image stack of one panorama, a
+# fetcher takes a free slot, writes the images of the panorama into it and hands the index of the
+# slot to a classifier, which reads the images in place and gives the slot back. The slots are in
+# shared memory when the classifiers are other processes, so only the index of the slot is sent
+# to them instead of pickling every image, and no image is allocated in the loop.
+
+# Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT
+
+import queue
+
+
+# the shared memory blocks attached in this process, by the name of the block
+_attached = {}
+
+
+class ImageRing(object):
+    '''
+    The ring of the image slots
+
+        numSlots: the number of the slots
+        slotShape: the shape of every slot, (N, H, W, 3) for the N images of a panorama
+        shared: if True, the slots are in shared memory, so they can be read by
+            the other processes, see ReadSlot, otherwise they are a numpy array
+            of this process
+    '''
+
+    def __init__(self, numSlots, slotShape, shared=True):
+        import numpy as np
+
+        self.numSlots = numSlots
+        self.slotShape = tuple(slotShape)
+        self.shm = None
+
+        shape = (numSlots,) + self.slotShape
+        if shared:
+            from multiprocessing.shared_memory import SharedMemory
+            self.shm = SharedMemory(create=True, size=int(np.prod(shape)))
+            self.slots = np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf)
+        else:
+            self.slots = np.empty(shape, dtype=np.uint8)
+
+        self.free = queue.Queue()
+        for index in range(numSlots):
+            self.free.put(index)
+
+    @property
+    def shared(self):
+        return self.shm is not None
+
+    @property
+    def name(self):
+        '''the name of the shared memory, None if the slots are not shared'''
+
+        return None if self.shm is None else self.shm.name
+
+    def acquire(self, stop=None):
+        '''
+        take a free slot, wait until a slot is given back if there is no free slot
+            stop: the threading.Event, stop waiting when it is set
+            return the index of the slot, None if the waiting is stopped
+        '''
+
+        while True:
+            try:
+                return self.free.get(timeout=0.1)
+            except queue.Empty:
+                if stop is not None and stop.is_set():
+                    return None
+
+    def release(self, index):
+        '''give the slot back to the ring'''
+
+        self.free.put(index)
+
+    def slot(self, index):
+        '''return the numpy array of the slot, the images are written and read in place'''
+
+        return self.slots[index]
+
+    def close(self):
+        '''free the shared memory, the slots can not be used anymore'''
+
+        if self.shm is None:
+            return
+
+        self.slots = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # a view of the slots is still used, the memory is freed when the process exits
+            pass
+        try:
+            self.shm.unlink()
+        except (OSError, FileNotFoundError):
+            pass
+        self.shm = None
+
+
+
+def ReadSlot(name, numSlots, slotShape, index, count):
+    '''
+    This function is used to read a slot of the ring created by another process,
+    the shared memory is attached once in every process
+        name: the name of the shared memory of the ring
+        numSlots, slotShape: the number and the shape of the slots of the ring
+        index: the index of the slot
+        count: the number of the images in the slot
+        return the (count, H, W, 3) numpy array of the images in the shared memory
+    '''
+
+    import numpy as np
+
+    attached = _attached.get(name)
+    if attached is None:
+        from multiprocessing.shared_memory import SharedMemory
+        shm = SharedMemory(name=name)
+        attached = _attached[name] = (shm, np.ndarray((numSlots,) + tuple(slotShape), dtype=np.uint8, buffer=shm.buf))
+
+    return attached[1][index][:count]
+
+
+
+def ClassifySlot(classify, name, numSlots, slotShape, index, count):
+    '''
+    This function is run in the classifier processes, it classifies the images
+    of a slot in place
+        classify: the function classifying the image stack of a panorama
+        the others: see ReadSlot
+        return the result of classify
+    '''
+
+    return classify(ReadSlot(name, numSlots, slotShape, index, count))
+
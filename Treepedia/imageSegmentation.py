@@ -0,0 +1,115 @@
+# This program provides the segmentation backends used by the object based image classification
+# of the GSV images (GreenView_Calculate.py). Every backend is a function which takes the uint8
+# GSV image in shape of (H, W, 3) and returns the segmented image with the same shape, in which
+# every pixel is replaced by the mean colour of the region it belongs to.
+
+# meanshift: the original meanshift segmentation implemented by pymeanshift
+# quantize: a vectorized numpy approximation, the regions are the pixels with the same quantized
+#           colour in the same square cell of the image, no C extension is needed
+# none: skip the segmentation, the pixels are classified directly
+
+# Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT
+
+
+def MeanShiftSegmentation(Img, spatial_radius=6, range_radius=7, min_density=40):
+    '''
+    This function is used to segment the GSV image by the meanshift algorithm
+    implemented by pymeanshift, the parameters are the same as the pymeanshift
+
+        Img: the numpy array image, uint8 in shape of (H, W, 3)
+        return the segmented image
+    '''
+
+    import pymeanshift as pms
+
+    (segmented_image, labels_image, number_regions) = pms.segment(Img,spatial_radius=spatial_radius,
+                                                     range_radius=range_radius, min_density=min_density)
+
+    return segmented_image
+
+
+
+def QuantizedSegmentation(Img, spatial_radius=6, range_radius=7):
+    '''
+    This function is a vectorized approximation of the meanshift segmentation.
+    The image is split into square cells of (2*spatial_radius + 1) pixels, the
+    colour of every band is quantized into bins of (2*range_radius + 1) levels,
+    a region is all the pixels with the same quantized colour in the same cell,
+    and every pixel is replaced by the mean colour of its region
+
+        Img: the numpy array image, uint8 in shape of (H, W, 3)
+        spatial_radius: the spatial radius of the regions in pixel
+        range_radius: the colour radius of the regions in 8 bit level
+        return the segmented image
+    '''
+
+    import numpy as np
+
+    height, width = Img.shape[:2]
+    cellSize = 2*spatial_radius + 1
+    binSize = 2*range_radius + 1
+    numBins = 255//binSize + 1
+
+    # the index of the cell and the quantized colour of every pixel
+    rows = np.arange(height)//cellSize
+    cols = np.arange(width)//cellSize
+    cellIdx = rows[:, np.newaxis]*(width//cellSize + 1) + cols[np.newaxis, :]
+
+    colourBin = Img//binSize
+    colourIdx = (colourBin[:,:,0].astype(np.int64)*numBins + colourBin[:,:,1])*numBins + colourBin[:,:,2]
+
+    regionIdx = cellIdx.astype(np.int64)*numBins**3 + colourIdx
+    regions, labels = np.unique(regionIdx.ravel(), return_inverse=True)
+    labels = labels.ravel()
+
+    # the mean colour of every region
+    count = np.bincount(labels, minlength=len(regions))
+    segmented_image = np.empty_like(Img)
+    for band in range(3):
+        total = np.bincount(labels, weights=Img[:,:,band].ravel(), minlength=len(regions))
+        meanColour = np.rint(total/count).astype(np.uint8)
+        segmented_image[:,:,band] = meanColour[labels].reshape(height, width)
+
+    return segmented_image
+
+
+
+def NoSegmentation(Img):
+    '''
+    This function skips the segmentation, the pixels of the GSV image are
+    classified directly
+
+        Img: the numpy array image, uint8 in shape of (H, W, 3)
+        return the image itself
+    '''
+
+    return Img
+
+
+
+# the segmentation backends can be selected by name
+SEGMENTERS = {
+    'meanshift': MeanShiftSegmentation,
+    'quantize': QuantizedSegmentation,
+    'none': NoSegmentation,
+}
+
+
+def getSegmenter(segmenter):
+    '''
+    This function is used to get the segmentation backend
+
+        segmenter: the name of the backend in SEGMENTERS, 'meanshift', 'quantize'
+            or 'none', or a function which takes the image and returns the
+            segmented image
+        return the segmentation function
+    '''
+
+    if callable(segmenter):
+        return segmenter
+
+    if segmenter not in SEGMENTERS:
+        raise ValueError('Unknown segmentation backend %s, choose from %s'%(segmenter, sorted(SEGMENTERS)))
+
+    return SEGMENTERS[segmenter]
+
@@ -0,0 +1,225 @@
+# This program is the scheduler of the Google Street View API keys. Every key has a token bucket
+# limiting its requests per second and a daily quota (each key can only request 25,000 imgs every
+# 24 hours). The requests are spread across all the keys, every request takes the key which is
+# allowed to send the earliest. The counters can be saved in a state file, then the restarted runs
+# and the parallel processes using the same state file share the same budget.
+
+# The bucket of a key is kept as the time of its next free request slot. A process reserves the
+# slots, and the quota, of a key in blocks of blockSize requests, taking the state file lock once
+# per block, and hands the slots of its blocks out to its threads in memory. The blocks of the
+# processes never overlap, so the rate of every key is kept across all the processes.
+
+# Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT
+
+import threading
+
+try:
+    from .fileLock import FileLock, atomicWrite
+except (ImportError, ValueError):
+    from fileLock import FileLock, atomicWrite
+
+
+class QuotaExceeded(Exception):
+    '''all the keys have used up their daily quota'''
+
+
+
+def ReadKeyFile(key_file):
+    '''
+    This function is used to read the API keys in txt file, each key is one row
+        key_file: the file name of the key file
+        return the list of the keys
+    '''
+
+    keylist = []
+    with open(key_file, 'r') as lines:
+        for line in lines:
+            key = line.strip()
+            if key:
+                keylist.append(key)
+
+    return keylist
+
+
+
+class KeyScheduler(object):
+    '''
+    The scheduler of the API keys, acquire() blocks until a key is allowed to send
+    a request and returns the key
+
+        keylist: the list of the API keys
+        rate: the number of the requests allowed every second for each key
+        dailyQuota: the number of the requests allowed every day for each key, the
+            day is counted in UTC
+        stateFile: the json file to save the counters, None to keep them in memory
+        burst: the number of the requests allowed at once for a key after an idle period
+        blockSize: the number of the requests of a key reserved at once by this
+            process, rate by default, i.e. one second of requests. The state file is
+            only read and written once per block, the requests reserved and not
+            sent are given back by close(), or lost from the quota if the process dies
+    '''
+
+    def __init__(self, keylist, rate=10.0, dailyQuota=25000, stateFile=None, burst=1, blockSize=None):
+        if len(keylist) == 0:
+            raise ValueError('The key list is empty')
+
+        self.keylist = list(keylist)
+        self.rate = float(rate)
+        self.dailyQuota = dailyQuota
+        self.stateFile = stateFile
+        self.burst = float(burst)
+        self.blockSize = max(1, int(rate)) if blockSize is None else blockSize
+        self.state = {'day': None, 'keys': {}}
+
+        # the blocks reserved by this process, the next slot, the end of the block and
+        # the number of the requests left of every key
+        self.blocks = {}
+        self.blocksLock = threading.Lock()
+
+        # the day on which every key used up the quota, the key is not reserved again on that day
+        self.exhausted = {}
+
+        if stateFile is None:
+            self.lock = threading.Lock()
+        else:
+            self.lock = FileLock(stateFile + '.lock')
+
+    def _load(self):
+        import json
+        import os,os.path
+
+        if self.stateFile is not None and os.path.exists(self.stateFile):
+            with open(self.stateFile, 'r') as f:
+                self.state = json.load(f)
+
+    def _save(self):
+        import json
+
+        if self.stateFile is not None:
+            atomicWrite(self.stateFile, json.dumps(self.state))
+
+    def _refill(self, now):
+        import time
+
+        # the daily counters start again every day
+        day = time.strftime('%Y-%m-%d', time.gmtime(now))
+        if self.state['day'] != day:
+            self.state['day'] = day
+            for counter in self.state['keys'].values():
+                counter['used'] = 0
+
+        for key in self.keylist:
+            counter = self.state['keys'].setdefault(key, {'used': 0, 'next': now})
+            # the state files of the earlier version keep the tokens of the bucket
+            counter.setdefault('next', now)
+
+    def _giveBack(self, key):
+        '''give the requests left in the block of the key back to the quota, in the state lock'''
+
+        block = self.blocks.pop(key, None)
+        if block is not None and block['day'] == self.state['day']:
+            counter = self.state['keys'][key]
+            counter['used'] = max(counter['used'] - block['left'], 0)
+
+    def _reserve(self, keys):
+        '''
+        reserve a new block of every key in keys, in one transaction of the state
+        file, the keys which have used up the quota get no block
+        '''
+
+        import time
+
+        with self.lock:
+            self._load()
+            now = time.time()
+            self._refill(now)
+
+            for key in keys:
+                self._giveBack(key)
+
+                counter = self.state['keys'][key]
+                count = int(min(self.blockSize, self.dailyQuota - counter['used']))
+                if count <= 0:
+                    self.exhausted[key] = self.state['day']
+                    continue
+
+                # the bucket is full after an idle period of burst requests
+                start = max(counter['next'], now - (self.burst - 1)/self.rate)
+                counter['next'] = start + count/self.rate
+                counter['used'] += count
+                self.blocks[key] = {'next': start, 'end': counter['next'], 'left': count, 'day': self.state['day']}
+
+            self._save()
+
+    def _usable(self, block, now):
+        '''the time of the next slot of the block, None if the block is used up'''
+
+        slot = max(block['next'], now)
+        if block['left'] <= 0 or slot + 1/self.rate > block['end'] + 1e-9:
+            return None
+
+        return slot
+
+    def acquire(self):
+        '''
+        Wait until a key is allowed to send a request, the request is counted
+        return the key
+        raise QuotaExceeded if all the keys have used up the daily quota
+        '''
+
+        import time
+
+        with self.blocksLock:
+            now = time.time()
+            day = time.strftime('%Y-%m-%d', time.gmtime(now))
+
+            # the slots of an idle block which have passed are not used, so the rate is kept
+            used = [key for key in self.keylist if self.exhausted.get(key) != day and
+                    (key not in self.blocks or self._usable(self.blocks[key], now) is None)]
+            if used:
+                self._reserve(used)
+                now = time.time()
+
+            slots = [(self._usable(self.blocks[key], now), key) for key in self.keylist if key in self.blocks]
+            slots = [(slot, key) for slot, key in slots if slot is not None]
+            if len(slots) == 0:
+                raise QuotaExceeded('All the %s keys have used up the daily quota of %s requests'%(len(self.keylist), self.dailyQuota))
+
+            # take the key which is allowed to send the earliest
+            slot, key = min(slots)
+            block = self.blocks[key]
+            block['next'] = slot + 1/self.rate
+            block['left'] -= 1
+
+        wait = slot - time.time()
+        if wait > 0:
+            time.sleep(wait)
+
+        return key
+
+    def close(self):
+        '''give the requests reserved by this process and not sent back to the quota'''
+
+        with self.blocksLock:
+            if len(self.blocks) == 0:
+                return
+
+            with self.lock:
+                self._load()
+                for key in list(self.blocks):
+                    self._giveBack(key)
+                self._save()
+
+    def usage(self):
+        '''
+        return the dictionary of the number of the requests sent today by each key,
+        the requests reserved by the processes and not sent yet are counted
+        '''
+
+        import time
+
+        with self.lock:
+            self._load()
+            self._refill(time.time())
+
+            return dict((key, self.state['keys'][key]['used']) for key in self.keylist)
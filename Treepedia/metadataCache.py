@@ -0,0 +1,178 @@
+# This program is the local cache of the GSV metadata used by metadataCollector.py. The answers of
+# the metadata requests are saved in a sqlite database keyed by the quantized coordinate of the
+# site, including the sites without panorama, so rerunning the collector, for example with another
+# sampling distance, doesn't ask the same questions again. The cached answers are the same as the
+# answers of the requests, so a warm run writes the same records as a cold run.
+
+# Optionally, with snapRadius, a site close to a panorama already in the cache is answered by that
+# panorama without any request, with 20 m sampling many sites snap to the same panorama. This is
+# an approximation, Google may answer the site with another panorama, e.g. a newer one or one on
+# the other side of an intersection, so the records then depend on the order the sites are asked
+# and on what is already in the cache.
+
+# The answers expire after ttl seconds, the sites without panorama after negativeTTL seconds,
+# because new panoramas are taken over time.
+
+# Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT
+
+import math
+import os,os.path
+import threading
+
+
+# the answer of the sites without panorama
+NO_PANORAMA = ()
+
+# the size of the grid cells in degree used to find the panoramas near a site
+PANO_GRID = 0.001
+
+# the length of one degree of latitude in meter
+METERS_PER_DEGREE = 111320.0
+
+
+class MetadataCache(object):
+    '''
+    The cache of the GSV metadata in a sqlite database, shared by the threads and
+    the processes using the same database file
+
+        cacheFile: the file name of the sqlite database
+        precision: the size in degree of the quantized coordinate of the sites
+        snapRadius: the distance in meter, a site closer than snapRadius to a
+            cached panorama is answered by the panorama, which is not always the
+            answer of Google for the site, 0 by default to only use the answers of
+            the same quantized coordinate, so the records don't depend on the cache
+        ttl: the time in second after which a cached panorama expires
+        negativeTTL: the time in second after which a site without panorama expires
+    '''
+
+    def __init__(self, cacheFile, precision=1e-5, snapRadius=0, ttl=180*86400, negativeTTL=30*86400):
+        self.cacheFile = cacheFile
+        self.precision = precision
+        self.snapRadius = snapRadius
+        self.ttl = ttl
+        self.negativeTTL = negativeTTL
+        self.local = threading.local()
+
+        folder = os.path.dirname(os.path.abspath(cacheFile))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        db = self._db()
+        with db:
+            # the answers of the sites, panoId is NULL if there is not panorama in the site
+            db.execute('CREATE TABLE IF NOT EXISTS sites (site TEXT PRIMARY KEY, panoDate TEXT, panoId TEXT, '
+                       'panoLat TEXT, panoLon TEXT, stamp REAL)')
+            # the panoramas, indexed by the grid cell of their coordinate
+            db.execute('CREATE TABLE IF NOT EXISTS panos (panoId TEXT PRIMARY KEY, panoDate TEXT, panoLat TEXT, '
+                       'panoLon TEXT, cellY INTEGER, cellX INTEGER, stamp REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS panos_cell ON panos (cellY, cellX)')
+
+    def _db(self):
+        '''the sqlite connection of this thread'''
+
+        import sqlite3
+
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.cacheFile, timeout=60)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+
+        return db
+
+    def _site(self, lat, lon):
+        '''the key of the quantized coordinate of the site'''
+
+        return '%d,%d'%(round(float(lat)/self.precision), round(float(lon)/self.precision))
+
+    def get(self, lat, lon):
+        '''
+        return the cached (panoDate, panoId, panoLat, panoLon) of the site, NO_PANORAMA
+        if there is not panorama in the site, None if the site is not in the cache
+        '''
+
+        import time
+
+        now = time.time()
+        db = self._db()
+
+        row = db.execute('SELECT panoDate, panoId, panoLat, panoLon, stamp FROM sites WHERE site = ?',
+                         (self._site(lat, lon),)).fetchone()
+        if row is not None:
+            panoDate, panoId, panoLat, panoLon, stamp = row
+            if panoId is None:
+                if now - stamp < self.negativeTTL:
+                    return NO_PANORAMA
+            elif now - stamp < self.ttl:
+                return panoDate, panoId, panoLat, panoLon
+
+        if self.snapRadius > 0:
+            return self._nearest(float(lat), float(lon), now)
+
+        return None
+
+    def _nearest(self, lat, lon, now):
+        '''return the nearest cached panorama closer than snapRadius to the site, None if there is not'''
+
+        # the ranges of the grid cells covering the circle of snapRadius
+        dLat = self.snapRadius/METERS_PER_DEGREE
+        dLon = dLat/max(math.cos(math.radians(lat)), 1e-6)
+
+        rows = self._db().execute('SELECT panoDate, panoId, panoLat, panoLon FROM panos '
+                                  'WHERE cellY BETWEEN ? AND ? AND cellX BETWEEN ? AND ? AND stamp > ?',
+                                  (int(math.floor((lat - dLat)/PANO_GRID)), int(math.floor((lat + dLat)/PANO_GRID)),
+                                   int(math.floor((lon - dLon)/PANO_GRID)), int(math.floor((lon + dLon)/PANO_GRID)),
+                                   now - self.ttl)).fetchall()
+
+        nearest = None
+        minDist = self.snapRadius
+        for panoDate, panoId, panoLat, panoLon in rows:
+            # the equirectangular distance in meter, accurate enough for a few meters
+            dy = (float(panoLat) - lat)*METERS_PER_DEGREE
+            dx = (float(panoLon) - lon)*METERS_PER_DEGREE*math.cos(math.radians(lat))
+            dist = math.sqrt(dx*dx + dy*dy)
+            if dist <= minDist:
+                nearest = (panoDate, panoId, panoLat, panoLon)
+                minDist = dist
+
+        return nearest
+
+    def put(self, lat, lon, panoInfo):
+        '''
+        save the answer of the site in the cache
+            lat, lon: the coordinate of the site
+            panoInfo: the (panoDate, panoId, panoLat, panoLon) of the panorama,
+                None or NO_PANORAMA if there is not panorama in the site
+        '''
+
+        import time
+
+        now = time.time()
+        db = self._db()
+
+        with db:
+            if not panoInfo:
+                db.execute('INSERT OR REPLACE INTO sites VALUES (?, NULL, NULL, NULL, NULL, ?)',
+                           (self._site(lat, lon), now))
+                return
+
+            panoDate, panoId, panoLat, panoLon = panoInfo
+            db.execute('INSERT OR REPLACE INTO sites VALUES (?, ?, ?, ?, ?, ?)',
+                       (self._site(lat, lon), panoDate, panoId, panoLat, panoLon, now))
+            db.execute('INSERT OR REPLACE INTO panos VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (panoId, panoDate, panoLat, panoLon, int(math.floor(float(panoLat)/PANO_GRID)),
+                        int(math.floor(float(panoLon)/PANO_GRID)), now))
+
+    def expire(self):
+        '''remove the expired answers from the cache'''
+
+        import time
+
+        now = time.time()
+        db = self._db()
+        with db:
+            db.execute('DELETE FROM sites WHERE panoId IS NULL AND stamp <= ?', (now - self.negativeTTL,))
+            db.execute('DELETE FROM sites WHERE panoId IS NOT NULL AND stamp <= ?', (now - self.ttl,))
+            db.execute('DELETE FROM panos WHERE stamp <= ?', (now - self.ttl,))
+
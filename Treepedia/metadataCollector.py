@@ -1,9 +1,128 @@
-
 # This function is used to collect the metadata of the GSV panoramas based on the sample point shapefile
 
 # Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT 
 
-def GSVpanoMetadataCollector(samplesFeatureClass,num,ouputTextFolder):
+# The metadata of the sample points are requested by a pool of threads, every thread keeps its own
+# keep-alive connection, the requests are limited by a token bucket (see keyScheduler.py), and
+# the failed requests are retried with a jittered exponential backoff. The answers can be saved in
+# a local metadata cache (see metadataCache.py), then the sites already asked, or close to a known
+# panorama, are answered without any request. Every panorama is only written to the first txt
+# file it is found in, see panoIndex.py. The collectors sharing a pipeline state database (see
+# pipelineState.py) claim the batches in the database, so they never collect the same batch.
+
+try:
+    from .keyScheduler import KeyScheduler
+    from .fileLock import atomicWrite
+    from .metadataCache import MetadataCache
+    from .panoIndex import PanoIndex
+    from .resultStore import ResultStore, ResultRecords
+    from .pipelineState import PipelineState
+except (ImportError, ValueError):
+    from keyScheduler import KeyScheduler
+    from fileLock import atomicWrite
+    from metadataCache import MetadataCache
+    from panoIndex import PanoIndex
+    from resultStore import ResultStore, ResultRecords
+    from pipelineState import PipelineState
+
+
+# the URL of the GSV metadata
+GSV_METADATA_URL = 'http://maps.google.com/cbk'
+
+
+def ParseGSVMetadata(metaData):
+    '''
+    This function is used to parse the xml metadata of the GSV panorama
+        metaData: the xml returned by the GSV metadata URL
+        return the (panoDate, panoId, panoLat, panoLon) of the panorama, None if
+            there is not panorama in the site
+    '''
+    
+    import xmltodict
+    
+    data = xmltodict.parse(metaData)
+    
+    # in case there is not panorama in the site
+    if data['panorama']==None:
+        return None
+    
+    panoInfo = list(data['panorama']['data_properties'].items())
+    
+    # get the meta data of the panorama
+    panoDate = panoInfo[4][1]
+    panoId = panoInfo[5][1]
+    panoLat = panoInfo[8][1]
+    panoLon = panoInfo[9][1]
+    
+    return panoDate, panoId, panoLat, panoLon
+
+
+
+def FetchPanoramaYaw(session, scheduler, panoID, baseURL=GSV_METADATA_URL):
+    '''
+    This function is used to get the yaw of a GSV panorama, the heading of the
+    capture car, which is the heading of the center column of the equirectangular
+    panorama, it is used to cut the images of the headings out of the panorama,
+    see the panoramaYaw of GreenViewPipeline in greenViewPipeline.py
+        session: the requests session used to send the request
+        scheduler: the KeyScheduler limiting the rate of the requests
+        panoID: the id of the panorama
+        baseURL: the URL of the GSV metadata, or of a local server for testing
+        return the yaw in degree
+    '''
+    
+    import xmltodict
+    
+    scheduler.acquire()
+    response = session.get(r'%s?output=xml&panoid=%s'%(baseURL, panoID), timeout=30)
+    response.raise_for_status()
+    
+    data = xmltodict.parse(response.content)
+    
+    return float(data['panorama']['projection_properties']['@pano_yaw_deg'])
+
+
+
+def FetchGSVMetadata(session, scheduler, lat, lon, maxRetries=5, backoff=0.5, baseURL=GSV_METADATA_URL):
+    '''
+    This function is used to request the metadata of the GSV panorama at a site,
+    the request is retried with a jittered exponential backoff when it fails
+        session: the requests session used to send the request
+        scheduler: the KeyScheduler limiting the rate of the requests
+        lat, lon: the coordinate of the site in WGS84
+        maxRetries: the number of the retries before giving up
+        backoff: the base waiting time in second before the first retry, doubled for every retry
+        baseURL: the URL of the GSV metadata, or of a local server for testing
+        return the xml metadata
+    '''
+    
+    import random
+    import time
+    import requests
+    
+    # get the meta data of panoramas 
+    urlAddress = r'%s?output=xml&ll=%s,%s'%(baseURL,lat,lon)
+    
+    for attempt in range(maxRetries + 1):
+        scheduler.acquire()
+        try:
+            response = session.get(urlAddress, timeout=30)
+            response.raise_for_status()
+            return response.content
+        
+        except requests.RequestException as e:
+            # the client errors except too many requests are not retried
+            status = getattr(e.response, 'status_code', None)
+            if attempt == maxRetries or (status is not None and 400 <= status < 500 and status != 429):
+                raise
+            
+            time.sleep(random.uniform(0, backoff*2**attempt))
+
+
+
+def GSVpanoMetadataCollector(samplesFeatureClass,num,ouputTextFolder,rate=20.0,numThreads=16,maxRetries=5,
+                             cacheFile=None,snapRadius=0,indexFile=None,storeFile=None,stateFile=None,
+                             baseURL=GSV_METADATA_URL):
     '''
     This function is used to call the Google API url to collect the metadata of
     Google Street View Panoramas. The input of the function is the shpfile of the create sample site, the output
@@ -13,15 +132,35 @@ def GSVpanoMetadataCollector(samplesFeatureClass,num,ouputTextFolder):
         samplesFeatureClass: the shapefile of the create sample sites
         num: the number of sites proced every time
         ouputTextFolder: the output folder for the panoinfo
+        rate: the number of the metadata requests every second
+        numThreads: the number of the threads sending the requests at the same time
+        maxRetries: the number of the retries of a failed request
+        cacheFile: the sqlite file of the metadata cache, None to not cache the metadata
+        snapRadius: the distance in meter, a site closer than snapRadius to a cached
+            panorama is answered by the cached panorama, 0 by default to disable it.
+            Snapping saves requests, but the cached panorama is not always the one
+            Google returns for the site, so a warm run may write other records than
+            a cold run
+        indexFile: the sqlite file of the index of the panoramas, every panorama is only
+            written to the first txt file it is found in, panoIndex.sqlite in the
+            ouputTextFolder by default. The panoramas of a removed txt file are written
+            again, the panoramas kept in the txt files of an earlier run with another
+            num are not, and a warning is printed
+        storeFile: the result store (see resultStore.py), the metadata of every batch are
+            also appended to the store as typed records, None to only write the txt files
+        stateFile: the pipeline state database (see pipelineState.py), the batches are
+            claimed in the database, and the sample points and the panoramas of every
+            batch are saved in the database, None to only write the txt files
+        baseURL: the URL of the GSV metadata, or of a local server for testing
         
     '''
     
-    import urllib,urllib2
-    import xmltodict
-    import cStringIO
+    from concurrent.futures import ThreadPoolExecutor
+    import threading
+    import requests
     import ogr, osr
-    import time
     import os,os.path
+    import socket
     
     if not os.path.exists(ouputTextFolder):
         os.makedirs(ouputTextFolder)
@@ -38,66 +177,155 @@ def GSVpanoMetadataCollector(samplesFeatureClass,num,ouputTextFolder):
     transform = osr.CoordinateTransformation(sourceProj, targetProj)
     
     # loop all the features in the featureclass
-    feature = layer.GetNextFeature()
     featureNum = layer.GetFeatureCount()
-    batch = featureNum/num
-    
-    for b in range(batch):
-        # for each batch process num GSV site
-        start = b*num
-        end = (b+1)*num
-        if end > featureNum:
-            end = featureNum
+    batch = featureNum//num
+    
+    # all the threads share the rate limit, every thread keeps its own connection alive
+    scheduler = KeyScheduler([baseURL], rate, dailyQuota=float('inf'))
+    local = threading.local()
+    
+    # the metadata cache, and the number of the sites answered by the cache and by requests
+    cache = None
+    if cacheFile is not None:
+        cache = MetadataCache(cacheFile, snapRadius=snapRadius)
+        cache.expire()
+    counts = {'cache': 0, 'request': 0, 'foreign': 0}
+    countsLock = threading.Lock()
+    
+    # the index of the panoramas already written to the txt files, by this run or the earlier runs
+    if indexFile is None:
+        indexFile = os.path.join(ouputTextFolder,'panoIndex.sqlite')
+    panoIndex = PanoIndex(indexFile)
+    
+    # the txt files of this run, the other owners in the index are the txt files of the earlier runs with another num
+    batchFiles = set('Pnt_start%s_end%s.txt'%(b*num, min((b+1)*num, featureNum)) for b in range(batch))
+    
+    # the owner is gone when its txt file is removed, unless it is still collected by another collector
+    def isStale(owner):
+        if os.path.exists(os.path.join(ouputTextFolder, owner)):
+            return False
+        return state is None or not state.isJobRunning(owner)
+    
+    store = None
+    if storeFile is not None:
+        store = ResultStore(storeFile)
+    
+    # the batches are claimed in the state database by the name of this process
+    state = None
+    if stateFile is not None:
+        state = PipelineState(stateFile)
+        workerName = '%s:%s'%(socket.gethostname(), os.getpid())
+    
+    def fetch(site):
+        lon, lat = site
+        if cache is not None:
+            panoInfo = cache.get(lat, lon)
+            if panoInfo is not None:
+                with countsLock:
+                    counts['cache'] += 1
+                return panoInfo or None
+        
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        
+        panoInfo = ParseGSVMetadata(FetchGSVMetadata(session, scheduler, lat, lon, maxRetries, baseURL=baseURL))
+        with countsLock:
+            counts['request'] += 1
+        
+        if cache is not None:
+            cache.put(lat, lon, panoInfo)
+        
+        return panoInfo
+    
+    def collectBatch(start, end, ouputTextFile, ouputGSVinfoFile):
+        # process num feature each time
+        sites = []
+        for i in range(start, end):
+            feature = layer.GetFeature(i)        
+            geom = feature.GetGeometryRef()
+            
+            # trasform the current projection of input shapefile to WGS84
+            #WGS84 is Earth centered, earth fixed terrestrial ref system
+            geom.Transform(transform)
+            sites.append((geom.GetX(), geom.GetY()))
         
-        ouputTextFile = 'Pnt_start%s_end%s.txt'%(start,end)
-        ouputGSVinfoFile = os.path.join(ouputTextFolder,ouputTextFile)
+        # the results are in the order of the sites, in case there is not panorama in the site, therefore, skip it
+        panoInfos = [panoInfo for panoInfo in executor.map(fetch, sites) if panoInfo is not None]
         
-        # skip over those existing txt files
-        if os.path.exists(ouputGSVinfoFile):
-            continue
+        # remove the panoramas found in the other txt files, and the duplicated panoramas of this txt file
+        owned = panoIndex.claimMany([panoInfo[1] for panoInfo in panoInfos], ouputTextFile, isStale)
+        foreign = sum(1 for panoInfo, isOwned in zip(panoInfos, owned)
+                      if not isOwned and panoIndex.owner(panoInfo[1]) not in batchFiles)
+        if foreign:
+            with countsLock:
+                counts['foreign'] += foreign
+        writtenIDs = set()
         
-        time.sleep(1)
+        lineTxts = []
+        batchInfos = []
+        for panoInfo, isOwned in zip(panoInfos, owned):
+            panoDate, panoId, panoLat, panoLon = panoInfo
+            if not isOwned or panoId in writtenIDs:
+                continue
+            writtenIDs.add(panoId)
+            
+            print ('The coordinate (%s,%s), panoId is: %s, panoDate is: %s'%(panoLon,panoLat,panoId, panoDate))
+            lineTxt = 'panoID: %s panoDate: %s longitude: %s latitude: %s\n'%(panoId, panoDate, panoLon, panoLat)
+            lineTxts.append(lineTxt)
+            batchInfos.append(panoInfo)
         
-        with open(ouputGSVinfoFile, 'w') as panoInfoText:
-            # process num feature each time
-            for i in range(start, end):
-                feature = layer.GetFeature(i)        
-                geom = feature.GetGeometryRef()
-                
-                # trasform the current projection of input shapefile to WGS84
-                #WGS84 is Earth centered, earth fixed terrestrial ref system
-                geom.Transform(transform)
-                lon = geom.GetX()
-                lat = geom.GetY()
-                key = r'' #Input Your Key here 
-                
-                # get the meta data of panoramas 
-                urlAddress = r'http://maps.google.com/cbk?output=xml&ll=%s,%s'%(lat,lon)
-                
-                time.sleep(0.05)
-                # the output result of the meta data is a xml object
-                metaDataxml = urllib2.urlopen(urlAddress)
-                metaData = metaDataxml.read()    
-                
-                data = xmltodict.parse(metaData)
-                
-                # in case there is not panorama in the site, therefore, continue
-                if data['panorama']==None:
-                    continue
-                else:
-                    panoInfo = data['panorama']['data_properties']
-                                        
-                    # get the meta data of the panorama
-                    panoDate = panoInfo.items()[4][1]
-                    panoId = panoInfo.items()[5][1]
-                    panoLat = panoInfo.items()[8][1]
-                    panoLon = panoInfo.items()[9][1]
-                    
-                    print 'The coordinate (%s,%s), panoId is: %s, panoDate is: %s'%(panoLon,panoLat,panoId, panoDate)
-                    lineTxt = 'panoID: %s panoDate: %s longitude: %s latitude: %s\n'%(panoId, panoDate, panoLon, panoLat)
-                    panoInfoText.write(lineTxt)
-                    
-        panoInfoText.close()
+        if store is not None:
+            panoDates, panoIds, panoLats, panoLons = zip(*batchInfos) if batchInfos else ([], [], [], [])
+            store.append(ResultRecords(panoIds, panoDates, panoLons, panoLats))
+        
+        if state is not None:
+            state.addPoints(ouputTextFile, [site[0] for site in sites], [site[1] for site in sites])
+            state.addPanos([(panoId, panoDate, panoLon, panoLat) for panoDate, panoId, panoLat, panoLon in batchInfos],
+                           ouputTextFile, status='collected')
+        
+        # the txt file is only written when all the sites of the batch are finished
+        atomicWrite(ouputGSVinfoFile, ''.join(lineTxts))
+    
+    executor = ThreadPoolExecutor(max_workers=numThreads)
+    
+    try:
+        for b in range(batch):
+            # for each batch process num GSV site
+            start = b*num
+            end = (b+1)*num
+            if end > featureNum:
+                end = featureNum
+            
+            ouputTextFile = 'Pnt_start%s_end%s.txt'%(start,end)
+            ouputGSVinfoFile = os.path.join(ouputTextFolder,ouputTextFile)
+            
+            # skip over those existing txt files
+            if os.path.exists(ouputGSVinfoFile):
+                continue
+            
+            # the batch collected by another collector sharing the state database
+            if state is not None and not state.claimJob(ouputTextFile, workerName, ouputGSVinfoFile):
+                continue
+            
+            try:
+                collectBatch(start, end, ouputTextFile, ouputGSVinfoFile)
+            except:
+                if state is not None:
+                    state.finishJob(ouputTextFile, 'failed')
+                raise
+            
+            if state is not None:
+                state.finishJob(ouputTextFile)
+    
+    finally:
+        executor.shutdown(wait=False)
+    
+    print ('The metadata of %s sites are requested, %s sites are answered by the cache'%(counts['request'], counts['cache']))
+    
+    if counts['foreign']:
+        print ('Warning: %s panoramas are kept in the txt files of an earlier run with another num, not in the txt files '
+               'of this run, remove the old txt files to write them again'%(counts['foreign']))
 
 
 # ------------Main Function -------------------    
@@ -107,6 +335,7 @@ if __name__ == "__main__":
     root = 'MYPATH/spatial-data'
     inputShp = os.path.join(root,'Cambridge20m.shp')
     outputTxt = root
+    cacheFile = os.path.join(root,'metadataCache.sqlite') # the answers of the metadata requests are cached here
     
-    GSVpanoMetadataCollector(inputShp,1000,outputTxt)
+    GSVpanoMetadataCollector(inputShp,1000,outputTxt,cacheFile=cacheFile)
 
@@ -0,0 +1,121 @@
+# This program is the index of the GSV panoramas used to remove the duplicated panoramas in the
+# whole pipeline. Many sample sites snap to the same panorama, every panorama is owned by the first
+# metadata txt file it is found in, and it is only kept in that file, so the GSV images of every
+# panorama are downloaded and classified exactly once. The index is keyed by the panoID only, a
+# panorama whose owner is gone, e.g. its txt file was removed, is given to the next owner.
+
+# The index is a hash set in memory, or a sqlite database shared by the processes and by the
+# restarted runs using the same index file.
+
+# Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT
+
+import os,os.path
+import threading
+
+
+class PanoIndex(object):
+    '''
+    The index of the panoIDs and their owners
+
+        indexFile: the sqlite file of the index, None to keep the index in memory
+    '''
+
+    def __init__(self, indexFile=None):
+        self.indexFile = indexFile
+        self.owners = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        if indexFile is not None:
+            folder = os.path.dirname(os.path.abspath(indexFile))
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+
+            db = self._db()
+            with db:
+                db.execute('CREATE TABLE IF NOT EXISTS panos (panoID TEXT PRIMARY KEY, owner TEXT)')
+
+    def _db(self):
+        '''the sqlite connection of this thread'''
+
+        import sqlite3
+
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.indexFile, timeout=60)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+
+        return db
+
+    def claim(self, panoID, owner='', isStale=None):
+        '''
+        add the panorama to the index if it is not in the index yet
+            panoID: the id of the panorama
+            owner: the name of the owner, e.g. the metadata txt file
+            isStale: the function telling if an owner is gone, e.g. its txt file was
+                removed, the panoramas of a stale owner are given to the owner, None
+                to keep every owner
+            return True if the panorama is owned by the owner, False if it is
+                owned by another owner
+        '''
+
+        return self.claimMany([panoID], owner, isStale)[0]
+
+    def claimMany(self, panoIDs, owner='', isStale=None):
+        '''
+        add the panoramas to the index in one transaction, see claim
+        return the list of True or False of the panoramas
+        '''
+
+        # every other owner is only checked once
+        stale = {}
+        def isGone(other):
+            if isStale is None or other == owner:
+                return False
+            if other not in stale:
+                stale[other] = isStale(other)
+            return stale[other]
+
+        if self.indexFile is None:
+            with self.lock:
+                owned = []
+                for panoID in panoIDs:
+                    if isGone(self.owners.setdefault(panoID, owner)):
+                        self.owners[panoID] = owner
+                    owned.append(self.owners[panoID] == owner)
+                return owned
+
+        db = self._db()
+        owned = []
+        with db:
+            for panoID in panoIDs:
+                db.execute('INSERT OR IGNORE INTO panos VALUES (?, ?)', (panoID, owner))
+                row = db.execute('SELECT owner FROM panos WHERE panoID = ?', (panoID,)).fetchone()
+                if isGone(row[0]):
+                    db.execute('UPDATE panos SET owner = ? WHERE panoID = ?', (owner, panoID))
+                    row = (owner,)
+                owned.append(row[0] == owner)
+
+        return owned
+
+    def owner(self, panoID):
+        '''return the owner of the panorama, None if it is not in the index'''
+
+        if self.indexFile is None:
+            return self.owners.get(panoID)
+
+        row = self._db().execute('SELECT owner FROM panos WHERE panoID = ?', (panoID,)).fetchone()
+
+        return None if row is None else row[0]
+
+    def __contains__(self, panoID):
+        return self.owner(panoID) is not None
+
+    def __len__(self):
+        if self.indexFile is None:
+            return len(self.owners)
+
+        return self._db().execute('SELECT COUNT(*) FROM panos').fetchone()[0]
+
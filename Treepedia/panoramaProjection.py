@@ -0,0 +1,114 @@
+# This program is used to cut the rectilinear GSV images of the headings out of the equirectangular
+# image of the whole panorama, so every panorama is downloaded with one request instead of one
+# request per heading. Every pixel of a rectilinear image is mapped to one pixel of the panorama,
+# the map only depends on the size of the panorama and the size, field of view, heading and pitch
+# of the image, it is computed once as a lookup table of the pixel indexes, and cutting an image
+# is a single numpy take on the panorama.
+
+# The tables are computed for a panorama whose center column faces north, the heading 0. The GSV
+# panoramas are centred on the heading of the capture car instead, the pano_yaw_deg of their
+# metadata, a turn of the panorama around the vertical axis is a circular shift of its columns, so
+# the images of these panoramas are cut with the same tables and the columns shifted by the yaw.
+
+# Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT
+
+import math
+
+
+# the lookup tables computed in this process, by the size of the panorama and the parameters of the image
+_remapTables = {}
+
+
+def RemapTable(panoShape, heading, pitch=0, size=(400, 400), fov=60):
+    '''
+    This function is used to get the lookup table of a rectilinear image of the
+    panorama, the tables are cached, so they are only computed once
+        panoShape: the (height, width) of the equirectangular panorama, the center
+            column of the panorama is assumed to be the heading 0, the north, the
+            top row is the pitch 90, see ReprojectPanorama for the other panoramas
+        heading, pitch: the heading and pitch of the camera in degree
+        size: the (width, height) of the image
+        fov: the horizontal field of view of the image in degree
+        return the numpy array of the flat indexes of the pixels of the panorama,
+            in the order of the pixels of the image
+    '''
+
+    import numpy as np
+
+    panoHeight, panoWidth = panoShape[:2]
+    width, height = size
+    key = (panoHeight, panoWidth, float(heading)%360, float(pitch), width, height, float(fov))
+
+    table = _remapTables.get(key)
+    if table is not None:
+        return table
+
+    # the rays of the pixel centers in the camera, x to the right, y up and z forward
+    focal = width/2.0/math.tan(math.radians(fov)/2)
+    x = np.arange(width) + 0.5 - width/2.0
+    y = height/2.0 - np.arange(height) - 0.5
+    x, y = np.meshgrid(x, y)
+    z = np.full_like(x, focal)
+
+    # turn the rays up by the pitch
+    pitchRad = math.radians(pitch)
+    y, z = y*math.cos(pitchRad) + z*math.sin(pitchRad), z*math.cos(pitchRad) - y*math.sin(pitchRad)
+
+    # the heading and the elevation of the rays, and their pixels in the panorama
+    yaw = np.arctan2(x, z) + math.radians(heading)
+    elevation = np.arctan2(y, np.hypot(x, z))
+
+    cols = np.floor((yaw/(2*math.pi) + 0.5)%1.0*panoWidth).astype(np.int64)
+    rows = np.floor((0.5 - elevation/math.pi)*panoHeight).astype(np.int64)
+    np.clip(cols, 0, panoWidth - 1, out=cols)
+    np.clip(rows, 0, panoHeight - 1, out=rows)
+
+    table = (rows*panoWidth + cols).ravel()
+    if panoHeight*panoWidth < 2**31:
+        table = table.astype(np.int32)
+
+    _remapTables[key] = table
+
+    return table
+
+
+
+def ReprojectPanorama(panorama, headingArr, pitch=0, size=(400, 400), fov=60, out=None, panoYaw=0):
+    '''
+    This function is used to cut the rectilinear images of the headings out of the
+    equirectangular panorama, the same images as the Street View Static API images
+    with the same heading, pitch, size and fov
+        panorama: the numpy array of the equirectangular panorama, uint8 in shape
+            of (H, W, 3), the center column is the heading panoYaw
+        headingArr: the heading angles of the images
+        pitch: the pitch angle of the images
+        size: the (width, height) of the images
+        fov: the horizontal field of view of the images in degree
+        out: the (N, height, width, 3) uint8 numpy array to store the images, None
+            to create a new one
+        panoYaw: the heading in degree of the center column of the panorama, 0 for
+            the panoramas facing north, the pano_yaw_deg of the metadata for the
+            GSV panoramas, the yaw is rounded to a column of the panorama
+        return the (N, height, width, 3) numpy array of the images
+    '''
+
+    import numpy as np
+
+    width, height = size
+    if out is None:
+        out = np.empty((len(headingArr), height, width, 3), dtype=np.uint8)
+
+    panoWidth = panorama.shape[1]
+    shift = int(round(-float(panoYaw)/360*panoWidth))%panoWidth
+
+    pixels = np.ascontiguousarray(panorama).reshape(-1, 3)
+    for n, heading in enumerate(headingArr):
+        table = RemapTable(panorama.shape, heading, pitch, size, fov)
+        if shift:
+            # shift the columns of the table, the rows are kept
+            cols = table%panoWidth
+            table = table - cols + (cols + shift)%panoWidth
+        np.take(pixels, table, axis=0, out=out[n].reshape(-1, 3))
+
+    return out
+
@@ -0,0 +1,300 @@
+# This program is the state database of the Treepedia pipeline, a sqlite database in WAL mode
+# holding the sample points, the metadata of the panoramas, the green percentages of every heading
+# and the status of the jobs. The processes of the pipeline share the database, the work is claimed
+# in transactions, so several workers never take the same work, and the results are written in
+# batches, one transaction for many rows. The export reads the results with indexed queries.
+
+# Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT
+
+import os,os.path
+import threading
+
+
+class PipelineState(object):
+    '''
+    The state database of the pipeline
+
+        stateFile: the file name of the sqlite database, it is created if it doesn't exist
+        lease: the time in second after which the work claimed by a worker which
+            doesn't report is given to the other workers
+        maxAttempts: the number of the failed attempts after which a panorama is
+            not computed again
+    '''
+
+    def __init__(self, stateFile, lease=600, maxAttempts=3):
+        self.stateFile = stateFile
+        self.lease = lease
+        self.maxAttempts = maxAttempts
+        self.local = threading.local()
+
+        folder = os.path.dirname(os.path.abspath(stateFile))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        db = self._db()
+        with db:
+            db.execute('CREATE TABLE IF NOT EXISTS points (id INTEGER PRIMARY KEY, source TEXT, '
+                       'longitude REAL, latitude REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS points_coordinate ON points (latitude, longitude)')
+
+            # status is collected, pending, running, done or failed
+            db.execute('CREATE TABLE IF NOT EXISTS panos (panoID TEXT PRIMARY KEY, panoDate TEXT, '
+                       'longitude REAL, latitude REAL, source TEXT, status TEXT NOT NULL DEFAULT \'pending\', '
+                       'worker TEXT, stamp REAL, attempts INTEGER NOT NULL DEFAULT 0, greenview REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS panos_coordinate ON panos (latitude, longitude)')
+            db.execute('CREATE INDEX IF NOT EXISTS panos_status ON panos (status)')
+            db.execute('CREATE INDEX IF NOT EXISTS panos_source ON panos (source)')
+
+            # the classified headings of the panoramas, the headings not downloaded are not saved
+            db.execute('CREATE TABLE IF NOT EXISTS headings (panoID TEXT, heading REAL, greenPercent REAL, '
+                       'greenPixels INTEGER, pixels INTEGER, PRIMARY KEY (panoID, heading))')
+
+            # the jobs of the other steps, e.g. the batches of the metadata collector
+            db.execute('CREATE TABLE IF NOT EXISTS jobs (name TEXT PRIMARY KEY, status TEXT, worker TEXT, stamp REAL)')
+
+    def _db(self):
+        '''the sqlite connection of this thread'''
+
+        import sqlite3
+
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.stateFile, timeout=60, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+
+        return db
+
+    def _transaction(self):
+        '''
+        the write transaction, taken at once so that two workers never read the
+        same work before one of them updates it
+        '''
+
+        db = self._db()
+
+        class Transaction(object):
+            def __enter__(self):
+                db.execute('BEGIN IMMEDIATE')
+                return db
+
+            def __exit__(self, excType, excValue, traceback):
+                db.execute('COMMIT' if excType is None else 'ROLLBACK')
+
+        return Transaction()
+
+    def addPoints(self, source, lons, lats):
+        '''
+        add the sample points in one transaction
+            source: the name of the source of the points, e.g. the batch of the metadata collector
+            lons, lats: the lists of the coordinates of the points
+        '''
+
+        with self._transaction() as db:
+            db.executemany('INSERT INTO points (source, longitude, latitude) VALUES (?, ?, ?)',
+                           ((source, float(lon), float(lat)) for lon, lat in zip(lons, lats)))
+
+    def addPanos(self, panoLst, source, status='pending'):
+        '''
+        add the panoramas in one transaction, the panoramas already in the
+        database are not added again, so every panorama is computed only once
+            panoLst: the list of the panos (panoID, panoDate, lon, lat)
+            source: the name of the metadata txt file of the panoramas
+            status: 'collected' for the metadata of the collector, 'pending' for the
+                panoramas to compute, the collected panoramas are then set pending
+            return the number of the added panoramas
+        '''
+
+        panoLst = list(panoLst)
+        with self._transaction() as db:
+            before = db.total_changes
+            db.executemany('INSERT OR IGNORE INTO panos (panoID, panoDate, longitude, latitude, source, status) '
+                           'VALUES (?, ?, ?, ?, ?, ?)',
+                           ((panoID, panoDate, float(lon), float(lat), source, status)
+                            for panoID, panoDate, lon, lat in panoLst))
+            added = db.total_changes - before
+
+            if status == 'pending':
+                db.executemany('UPDATE panos SET status = \'pending\' WHERE panoID = ? AND status = \'collected\'',
+                               ((pano[0],) for pano in panoLst))
+
+        return added
+
+    def retryFailed(self):
+        '''give the failed panoramas with less than maxAttempts attempts to the workers again'''
+
+        with self._transaction() as db:
+            db.execute('UPDATE panos SET status = \'pending\' WHERE status = \'failed\' AND attempts < ?',
+                       (self.maxAttempts,))
+
+    def claimPanos(self, worker, count):
+        '''
+        claim the pending panoramas, and the running panoramas of the workers not
+        reporting for longer than the lease
+            worker: the name of the worker
+            count: the maximum number of the panoramas
+            return the list of the panos (panoID, panoDate, lon, lat)
+        '''
+
+        import time
+
+        now = time.time()
+        with self._transaction() as db:
+            rows = db.execute('SELECT panoID, panoDate, longitude, latitude FROM panos '
+                              'WHERE status = \'pending\' OR (status = \'running\' AND stamp < ?) '
+                              'ORDER BY rowid LIMIT ?', (now - self.lease, count)).fetchall()
+            db.executemany('UPDATE panos SET status = \'running\', worker = ?, stamp = ? WHERE panoID = ?',
+                           ((worker, now, row[0]) for row in rows))
+
+        return rows
+
+    def heartbeat(self, worker):
+        '''tell the other workers the panoramas claimed by the worker are still in progress'''
+
+        import time
+
+        with self._transaction() as db:
+            db.execute('UPDATE panos SET stamp = ? WHERE worker = ? AND status = \'running\'', (time.time(), worker))
+
+    def release(self, worker):
+        '''give the running panoramas of the worker back to the other workers'''
+
+        with self._transaction() as db:
+            db.execute('UPDATE panos SET status = \'pending\', worker = NULL WHERE worker = ? AND status = \'running\'',
+                       (worker,))
+
+    def saveResults(self, results):
+        '''
+        save the results of the panoramas in one transaction
+            results: the list of the records of the panoramas, see GreenViewRecords
+                in GreenView_Calculate.py, with the keys of panoID, status, 'done' or
+                'failed', greenview, and the lists of headings, greenPixels and pixels,
+                greenPixels is None for the headings not downloaded or classified
+        '''
+
+        with self._transaction() as db:
+            db.executemany('UPDATE panos SET status = ?, greenview = ?, worker = NULL, '
+                           'attempts = attempts + ? WHERE panoID = ?',
+                           ((result['status'], result['greenview'], int(result['status'] == 'failed'), result['panoID'])
+                            for result in results))
+            db.executemany('DELETE FROM headings WHERE panoID = ?', ((result['panoID'],) for result in results))
+            db.executemany('INSERT INTO headings VALUES (?, ?, ?, ?, ?)',
+                           ((result['panoID'], heading, greenPxlNum/float(pxlNum)*100, greenPxlNum, pxlNum)
+                            for result in results
+                            for heading, greenPxlNum, pxlNum in zip(result.get('headings', []), result.get('greenPixels', []),
+                                                                    result.get('pixels', []))
+                            if greenPxlNum is not None))
+
+    def counts(self):
+        '''return the dictionary of the number of the panoramas of every status'''
+
+        counts = {'collected': 0, 'pending': 0, 'running': 0, 'done': 0, 'failed': 0}
+        counts.update(self._db().execute('SELECT status, COUNT(*) FROM panos GROUP BY status').fetchall())
+
+        return counts
+
+    def sourceCounts(self):
+        '''return the dictionary of the number of the unfinished panoramas of every source'''
+
+        return dict(self._db().execute('SELECT source, COUNT(*) FROM panos WHERE status IN (\'pending\', \'running\') '
+                                       'GROUP BY source').fetchall())
+
+    def sources(self):
+        '''return the set of the sources of the panoramas in the database'''
+
+        return set(row[0] for row in self._db().execute('SELECT DISTINCT source FROM panos').fetchall())
+
+    def results(self, source=None, bbox=None):
+        '''
+        return the list of the (panoID, panoDate, lon, lat, greenview) of the finished
+        panoramas, in the order they were added
+            source: only the panoramas of the source, None for all the sources
+            bbox: only the panoramas in the (minLon, minLat, maxLon, maxLat), None for no limit
+        '''
+
+        sql = 'SELECT panoID, panoDate, longitude, latitude, greenview FROM panos WHERE status IN (\'done\', \'failed\')'
+        args = []
+        if source is not None:
+            sql += ' AND source = ?'
+            args.append(source)
+        if bbox is not None:
+            sql += ' AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?'
+            args.extend([bbox[1], bbox[3], bbox[0], bbox[2]])
+
+        return self._db().execute(sql + ' ORDER BY rowid', args).fetchall()
+
+    def headings(self, panoID):
+        '''return the list of the (heading, greenPercent, greenPixels, pixels) of the classified headings of the panorama'''
+
+        return self._db().execute('SELECT heading, greenPercent, greenPixels, pixels FROM headings WHERE panoID = ? '
+                                  'ORDER BY heading', (panoID,)).fetchall()
+
+    def aggregate(self, minHeadings=6, bbox=None):
+        '''
+        calculate the green view index of the panoramas again from the saved headings,
+        without downloading or classifying the images again, e.g. to also use the
+        panoramas with some headings not downloaded
+            minHeadings: the minimum number of the classified headings of a panorama
+            bbox: only the panoramas in the (minLon, minLat, maxLon, maxLat), None for no limit
+            return the list of the (panoID, panoDate, lon, lat, greenview, numHeadings)
+                of the panoramas with minHeadings headings, in the order they were added
+        '''
+
+        sql = ('SELECT panos.panoID, panoDate, longitude, latitude, AVG(greenPercent), COUNT(*) '
+               'FROM panos JOIN headings ON panos.panoID = headings.panoID')
+        args = []
+        if bbox is not None:
+            sql += ' WHERE latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?'
+            args.extend([bbox[1], bbox[3], bbox[0], bbox[2]])
+        sql += ' GROUP BY panos.panoID HAVING COUNT(*) >= ? ORDER BY panos.rowid'
+        args.append(minHeadings)
+
+        return self._db().execute(sql, args).fetchall()
+
+    def claimJob(self, name, worker, output=None):
+        '''
+        claim a job, e.g. a batch of the metadata collector
+            name: the name of the job
+            worker: the name of the worker
+            output: the file written by the job, if it is given, a done job whose
+                file was deleted is claimed again
+            return True if the job is claimed, False if it is done, or running in
+                another worker which reported within the lease
+        '''
+
+        import time
+
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute('SELECT status, stamp FROM jobs WHERE name = ?', (name,)).fetchone()
+            if row is not None and row[0] == 'done':
+                if output is None or os.path.exists(output):
+                    return False
+            elif row is not None and now - row[1] < self.lease:
+                return False
+
+            db.execute('INSERT OR REPLACE INTO jobs VALUES (?, \'running\', ?, ?)', (name, worker, now))
+
+        return True
+
+    def isJobRunning(self, name):
+        '''return True if the job is running in a worker which reported within the lease'''
+
+        import time
+
+        row = self._db().execute('SELECT status, stamp FROM jobs WHERE name = ?', (name,)).fetchone()
+
+        return row is not None and row[0] == 'running' and time.time() - row[1] < self.lease
+
+    def finishJob(self, name, status='done'):
+        '''set the status of the job, 'done', or 'failed' to let the other workers take it again'''
+
+        import time
+
+        with self._transaction() as db:
+            if status == 'done':
+                db.execute('UPDATE jobs SET status = ?, stamp = ? WHERE name = ?', (status, time.time(), name))
+            else:
+                db.execute('DELETE FROM jobs WHERE name = ?', (name,))
+
@@ -0,0 +1,331 @@
+# This program is the columnar store of the results of the Treepedia pipeline, the panoramas with
+# their metadata and green view index. The results are typed binary records of fixed size in an
+# append-only file, read by memory mapping as a numpy structured array, so millions of results
+# are loaded, filtered and joined with vectorized numpy operations instead of parsing text lines.
+
+# Every append is a block of records, the range of the dates and coordinates of every block is
+# saved in the index file next to the store, a query by date or bounding box only reads the blocks
+# which can match.
+
+# Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT
+
+import os,os.path
+
+try:
+    from .fileLock import FileLock, atomicWrite
+except (ImportError, ValueError):
+    from fileLock import FileLock, atomicWrite
+
+
+# the fields of the record of a panorama, the panoDate is 'YYYY-MM', greenview is nan if it is not computed
+RESULT_FIELDS = [('panoID', 'S64'), ('panoDate', 'S7'), ('longitude', '<f8'),
+                 ('latitude', '<f8'), ('greenview', '<f4')]
+
+# the fields of the range of the records of every block
+BLOCK_FIELDS = [('start', '<i8'), ('count', '<i8'), ('minDate', 'S7'), ('maxDate', 'S7'),
+                ('minLon', '<f8'), ('maxLon', '<f8'), ('minLat', '<f8'), ('maxLat', '<f8')]
+
+# the header of the store file, the magic and the size of the record
+STORE_MAGIC = b'TREEPEDIA-RESULTS-1\n'
+HEADER_SIZE = 64
+
+
+def _dtypes():
+    '''the numpy dtypes of the records and the blocks'''
+
+    import numpy as np
+
+    return np.dtype(RESULT_FIELDS), np.dtype(BLOCK_FIELDS)
+
+
+
+def ResultRecords(panoIDs, panoDates, lons, lats, greenviews=None):
+    '''
+    This function is used to create the result records from the columns
+        panoIDs, panoDates: the lists of the panorama ids and dates
+        lons, lats: the lists of the longitudes and latitudes, numbers or strings
+        greenviews: the list of the green view indexes, None if not computed
+        return the numpy structured array of RESULT_FIELDS
+    '''
+
+    import numpy as np
+
+    RESULT_DTYPE = _dtypes()[0]
+
+    records = np.zeros(len(panoIDs), dtype=RESULT_DTYPE)
+    records['panoID'] = panoIDs
+    records['panoDate'] = panoDates
+    records['longitude'] = np.asarray(lons, dtype=np.float64)
+    records['latitude'] = np.asarray(lats, dtype=np.float64)
+    records['greenview'] = np.nan if greenviews is None else np.asarray(greenviews, dtype=np.float32)
+
+    return records
+
+
+
+def _blockOf(records, start):
+    '''the index entry of a block of records'''
+
+    import numpy as np
+
+    BLOCK_DTYPE = _dtypes()[1]
+
+    block = np.zeros(1, dtype=BLOCK_DTYPE)
+    block['start'] = start
+    block['count'] = len(records)
+    if len(records):
+        # numpy has no min and max of the byte strings
+        dates = np.sort(records['panoDate'])
+        block['minDate'] = dates[0]
+        block['maxDate'] = dates[-1]
+        block['minLon'] = records['longitude'].min()
+        block['maxLon'] = records['longitude'].max()
+        block['minLat'] = records['latitude'].min()
+        block['maxLat'] = records['latitude'].max()
+
+    return block
+
+
+
+def _indexedEnd(blocks):
+    '''the number of records up to the end of the last index entry'''
+
+    return int((blocks['start'] + blocks['count']).max()) if len(blocks) else 0
+
+
+
+def _header():
+    RESULT_DTYPE = _dtypes()[0]
+    header = STORE_MAGIC + b'%d\n'%(RESULT_DTYPE.itemsize)
+    return header + b'\0'*(HEADER_SIZE - len(header))
+
+
+
+def WriteResultStore(storeFile, records, blockSize=65536):
+    '''
+    This function is used to write a new result store atomically, replacing the
+    existing store, the records are split into blocks of blockSize records
+        storeFile: the file name of the store
+        records: the numpy structured array of RESULT_FIELDS
+        blockSize: the number of the records of every block of the index
+    '''
+
+    import numpy as np
+
+    RESULT_DTYPE, BLOCK_DTYPE = _dtypes()
+
+    records = np.asarray(records, dtype=RESULT_DTYPE)
+    blocks = [_blockOf(records[start:start + blockSize], start) for start in range(0, len(records), blockSize)]
+    blocks = np.concatenate(blocks) if blocks else np.zeros(0, dtype=BLOCK_DTYPE)
+
+    with FileLock(storeFile + '.lock'):
+        # without index all the records are read, so a crash never leaves an index of the old store
+        if os.path.exists(storeFile + '.idx'):
+            os.remove(storeFile + '.idx')
+        atomicWrite(storeFile, _header() + records.tobytes())
+        atomicWrite(storeFile + '.idx', blocks.tobytes())
+
+
+
+class ResultStore(object):
+    '''
+    The append-only store of the result records, shared by the processes using
+    the same store file
+
+        storeFile: the file name of the store, it is created if it doesn't exist
+    '''
+
+    def __init__(self, storeFile):
+        RESULT_DTYPE = _dtypes()[0]
+
+        self.storeFile = storeFile
+        self.indexFile = storeFile + '.idx'
+        self.lock = FileLock(storeFile + '.lock')
+
+        if not os.path.exists(storeFile):
+            with self.lock:
+                if not os.path.exists(storeFile):
+                    atomicWrite(storeFile, _header())
+
+        with open(storeFile, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+        if not header.startswith(STORE_MAGIC) or int(header[len(STORE_MAGIC):].split(b'\n')[0]) != RESULT_DTYPE.itemsize:
+            raise ValueError('%s is not a result store of this version'%(storeFile))
+
+    def append(self, records):
+        '''
+        append a block of records to the store, the records are flushed to the
+        disk before the block is added to the index
+            records: the numpy structured array of RESULT_FIELDS
+        '''
+
+        import numpy as np
+
+        RESULT_DTYPE, BLOCK_DTYPE = _dtypes()
+
+        records = np.asarray(records, dtype=RESULT_DTYPE)
+        if len(records) == 0:
+            return
+
+        with self.lock:
+            with open(self.storeFile, 'r+b') as f:
+                # a record broken by a crash is overwritten
+                size = os.fstat(f.fileno()).st_size
+                start = (size - HEADER_SIZE)//RESULT_DTYPE.itemsize
+
+                # the records written by a crash before their index entry get their own entry
+                indexed = _indexedEnd(self._readBlocks())
+                orphans = np.zeros(0, dtype=RESULT_DTYPE)
+                if indexed < start:
+                    f.seek(HEADER_SIZE + indexed*RESULT_DTYPE.itemsize)
+                    orphans = np.frombuffer(f.read((start - indexed)*RESULT_DTYPE.itemsize), dtype=RESULT_DTYPE)
+
+                f.seek(HEADER_SIZE + start*RESULT_DTYPE.itemsize)
+                f.write(records.tobytes())
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+
+            with open(self.indexFile, 'ab') as f:
+                # an entry broken by a crash is overwritten
+                f.truncate(f.tell()//BLOCK_DTYPE.itemsize*BLOCK_DTYPE.itemsize)
+                if len(orphans):
+                    f.write(_blockOf(orphans, indexed).tobytes())
+                f.write(_blockOf(records, start).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+    def read(self):
+        '''
+        return all the records as a read only memory mapped numpy structured array,
+        the records are only read from the disk when they are used
+        '''
+
+        import numpy as np
+
+        RESULT_DTYPE = _dtypes()[0]
+
+        size = os.path.getsize(self.storeFile)
+        count = (size - HEADER_SIZE)//RESULT_DTYPE.itemsize
+        if count == 0:
+            return np.zeros(0, dtype=RESULT_DTYPE)
+
+        return np.memmap(self.storeFile, dtype=RESULT_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,))
+
+    def _readBlocks(self):
+        '''the complete entries of the index file'''
+
+        import numpy as np
+
+        BLOCK_DTYPE = _dtypes()[1]
+
+        if not os.path.exists(self.indexFile):
+            return np.zeros(0, dtype=BLOCK_DTYPE)
+
+        with open(self.indexFile, 'rb') as f:
+            data = f.read()
+        return np.frombuffer(data[:len(data)//BLOCK_DTYPE.itemsize*BLOCK_DTYPE.itemsize], dtype=BLOCK_DTYPE)
+
+    def blocks(self):
+        '''return the index of the blocks, every range of records not in any block is an unbounded block'''
+
+        import numpy as np
+
+        RESULT_DTYPE, BLOCK_DTYPE = _dtypes()
+
+        blocks = self._readBlocks()
+
+        # the records appended without index entry, e.g. by a crash, are always read
+        count = (os.path.getsize(self.storeFile) - HEADER_SIZE)//RESULT_DTYPE.itemsize
+        gaps = []
+        covered = 0
+        for start, end in sorted(zip(blocks['start'].tolist(), (blocks['start'] + blocks['count']).tolist())):
+            if covered < start:
+                gaps.append((covered, start))
+            covered = max(covered, end)
+        if covered < count:
+            gaps.append((covered, count))
+
+        if gaps:
+            gap = np.zeros(len(gaps), dtype=BLOCK_DTYPE)
+            gap['start'] = [start for start, end in gaps]
+            gap['count'] = [end - start for start, end in gaps]
+            gap['minDate'] = b''
+            gap['maxDate'] = b'9999-99'
+            gap['minLon'], gap['minLat'] = -np.inf, -np.inf
+            gap['maxLon'], gap['maxLat'] = np.inf, np.inf
+            blocks = np.concatenate([blocks, gap])
+
+        return blocks
+
+    def query(self, startDate=None, endDate=None, bbox=None):
+        '''
+        return the records taken between startDate and endDate in the bounding box,
+        only the blocks whose range overlaps the query are read
+            startDate, endDate: the first and the last date 'YYYY-MM', None for no limit
+            bbox: the (minLon, minLat, maxLon, maxLat), None for no limit
+            return the numpy structured array of the records
+        '''
+
+        import numpy as np
+
+        RESULT_DTYPE = _dtypes()[0]
+
+        records = self.read()
+        blocks = self.blocks()
+        if len(records) == 0 or len(blocks) == 0:
+            return np.zeros(0, dtype=RESULT_DTYPE)
+
+        # the blocks which can match the query
+        candidates = np.ones(len(blocks), dtype=bool)
+        if startDate is not None:
+            candidates &= blocks['maxDate'] >= startDate.encode()
+        if endDate is not None:
+            candidates &= blocks['minDate'] <= endDate.encode()
+        if bbox is not None:
+            minLon, minLat, maxLon, maxLat = bbox
+            candidates &= (blocks['maxLon'] >= minLon) & (blocks['minLon'] <= maxLon)
+            candidates &= (blocks['maxLat'] >= minLat) & (blocks['minLat'] <= maxLat)
+
+        results = []
+        for block in blocks[candidates]:
+            chunk = records[block['start']:block['start'] + block['count']]
+
+            mask = np.ones(len(chunk), dtype=bool)
+            if startDate is not None:
+                mask &= chunk['panoDate'] >= startDate.encode()
+            if endDate is not None:
+                mask &= chunk['panoDate'] <= endDate.encode()
+            if bbox is not None:
+                mask &= (chunk['longitude'] >= minLon) & (chunk['longitude'] <= maxLon)
+                mask &= (chunk['latitude'] >= minLat) & (chunk['latitude'] <= maxLat)
+
+            results.append(np.array(chunk[mask]))
+
+        if len(results) == 0:
+            return np.zeros(0, dtype=RESULT_DTYPE)
+
+        return np.concatenate(results)
+
+    def __len__(self):
+        RESULT_DTYPE = _dtypes()[0]
+
+        return (os.path.getsize(self.storeFile) - HEADER_SIZE)//RESULT_DTYPE.itemsize
+
+
+
+def UniqueResults(records):
+    '''
+    This function is used to remove the duplicated panoramas and the invalid
+    green view indexes of the records, the first record of every panorama is kept
+        records: the numpy structured array of RESULT_FIELDS
+        return the numpy structured array, in the order of the records
+    '''
+
+    import numpy as np
+
+    records = records[records['greenview'] >= 0]
+    panoIDs, first = np.unique(records['panoID'], return_index=True)
+
+    return records[np.sort(first)]
+
@@ -0,0 +1,147 @@
+# This program is the fused kernel of the per-pixel vegetation rules of GreenView_Calculate.py. The
+# numpy version of the rules makes about fifteen passes over the image, the bands, the ExG image,
+# the threshold masks and their products. The kernel makes two passes over the uint8 segmented
+# image without any temporary image, the first one counts the histogram of the ExG levels for the
+# Otsu threshold, the second one counts the green vegetation pixels. The loops are compiled by
+# numba when it is installed, otherwise the same counts are computed with numpy.
+
+# Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT
+
+
+# the compiled kernels, (ExG histogram, green pixel count), False if numba is not installed
+_kernels = None
+
+
+def _exgHistogramLoop(img, hist):
+    '''count the levels of k = 2*green - red - blue of the image into hist, the negative levels as 0'''
+
+    height, width = img.shape[0], img.shape[1]
+    for i in range(height):
+        for j in range(width):
+            level = 2*int(img[i, j, 1]) - int(img[i, j, 0]) - int(img[i, j, 2])
+            if level < 0:
+                level = 0
+            elif level > 255:
+                level = 255
+            hist[level] += 1
+
+    return hist
+
+
+
+def _greenCountLoop(img, exgCutoff, shadowCutoff, redCutoff, greenCutoff, blueCutoff, darkCutoff):
+    '''count the pixels of the image passing the rules of IntegerVegetationMask'''
+
+    height, width = img.shape[0], img.shape[1]
+    count = 0
+    for i in range(height):
+        for j in range(width):
+            red = int(img[i, j, 0])
+            green = int(img[i, j, 1])
+            blue = int(img[i, j, 2])
+            level = 2*green - red - blue
+
+            if red < redCutoff and blue < blueCutoff and green < greenCutoff and level > exgCutoff:
+                count += 1
+            elif red < darkCutoff and green < darkCutoff and blue < darkCutoff and level > shadowCutoff:
+                count += 1
+
+    return count
+
+
+
+def _getKernels():
+    '''compile the kernels once in every process, return False if numba is not installed'''
+
+    global _kernels
+
+    if _kernels is None:
+        try:
+            import numba
+        except ImportError:
+            _kernels = False
+        else:
+            _kernels = (numba.njit(cache=True, nogil=True)(_exgHistogramLoop),
+                        numba.njit(cache=True, nogil=True)(_greenCountLoop))
+
+    return _kernels
+
+
+
+def HasCompiledKernel():
+    '''return True if the kernels are compiled by numba, False if numpy is used'''
+
+    return _getKernels() is not False
+
+
+
+def ExGHistogram(img, compiled=True):
+    '''
+    This function is used to count the 256 bins histogram of the ExG levels of an
+    image, k = 2*green - red - blue, the negative levels are counted as 0 and the
+    levels over 255 as 255, the same as LevelHistogram of the ExG image
+        img: the uint8 numpy array of the segmented image, in shape of (H, W, 3)
+        compiled: if False, always use numpy, e.g. to compare the two versions
+        return the histogram, the int64 numpy array of 256 counts
+    '''
+
+    import numpy as np
+
+    kernels = _getKernels() if compiled else False
+    if kernels:
+        return kernels[0](img, np.zeros(256, dtype=np.int64))
+
+    level = img[:,:,1].astype(np.int16)
+    level *= 2
+    level -= img[:,:,0]
+    level -= img[:,:,2]
+    np.clip(level, 0, 255, out=level)
+
+    return np.bincount(level.ravel(), minlength=256).astype(np.int64)
+
+
+
+def GreenPixelCount(img, exgCutoff, shadowCutoff, bandCutoffs, compiled=True):
+    '''
+    This function is used to count the green vegetation pixels of an image, the
+    pixels with all the bands under the band cutoffs and the ExG level over the
+    ExG cutoff, or with all the bands under the shadow band cutoff and the ExG
+    level over the shadow ExG cutoff
+        img: the uint8 numpy array of the segmented image, in shape of (H, W, 3)
+        exgCutoff, shadowCutoff: the integer ExG cutoff levels, see ExGLevelCutoff
+            in GreenView_Calculate.py
+        bandCutoffs: the (red, green, blue, shadow) integer band cutoffs
+        compiled: if False, always use numpy
+        return the number of the green vegetation pixels
+    '''
+
+    import numpy as np
+
+    redCutoff, greenCutoff, blueCutoff, darkCutoff = bandCutoffs
+
+    kernels = _getKernels() if compiled else False
+    if kernels:
+        return int(kernels[1](img, exgCutoff, shadowCutoff, redCutoff, greenCutoff, blueCutoff, darkCutoff))
+
+    red = img[:,:,0]
+    green = img[:,:,1]
+    blue = img[:,:,2]
+
+    level = green.astype(np.int16)
+    level *= 2
+    level -= red
+    level -= blue
+
+    greenImg = red < redCutoff
+    greenImg &= blue < blueCutoff
+    greenImg &= green < greenCutoff
+    greenImg &= level > exgCutoff
+
+    shadowImg = red < darkCutoff
+    shadowImg &= green < darkCutoff
+    shadowImg &= blue < darkCutoff
+    shadowImg &= level > shadowCutoff
+
+    greenImg |= shadowImg
+
+    return int(np.count_nonzero(greenImg))
@@ -0,0 +1,167 @@
+# This program is the work queue shared by the worker processes of the green view index
+# calculation. The panoramas are split into small work units, every unit is a json file in the
+# pending folder of the queue. A worker claims a unit by renaming it to the running folder, the
+# renaming is atomic, so exactly one worker gets the unit without any lock, and a unit is moved
+# to the done folder when it is finished. The workers started by different runs of the code share
+# the same queue, the faster workers simply claim more units.
+
+# A running unit is touched by its worker after every panorama, the units not touched for longer
+# than the lease, for example the units of a crashed worker, are moved back to the pending folder.
+
+# Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT
+
+import os,os.path
+
+try:
+    from .fileLock import atomicWrite
+except (ImportError, ValueError):
+    from fileLock import atomicWrite
+
+
+def ShardPanoramas(panoLst, unitSize):
+    '''
+    This function is used to split the panoramas into work units
+        panoLst: the list of the panoramas
+        unitSize: the number of the panoramas in every unit
+        return the list of the units, every unit is a list of panoramas
+    '''
+
+    return [panoLst[i:i + unitSize] for i in range(0, len(panoLst), unitSize)]
+
+
+
+class WorkQueue(object):
+    '''
+    The work queue in a folder, with the sub folders of pending, running and done
+
+        folder: the folder of the queue
+        lease: the time in second after which a running unit not touched by its
+            worker is given to the other workers
+    '''
+
+    def __init__(self, folder, lease=600):
+        self.folder = folder
+        self.lease = lease
+        for state in ('pending', 'running', 'done'):
+            path = os.path.join(folder, state)
+            if not os.path.exists(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    pass
+
+    def _path(self, state, name=''):
+        return os.path.join(self.folder, state, name)
+
+    def _names(self, state):
+        return sorted(name for name in os.listdir(self._path(state)) if name.startswith('unit_'))
+
+    def add(self, units):
+        '''
+        add the work units to the queue, only one process should add units at a time
+            units: the list of the work units, every unit is a json serializable
+                dictionary, unit['panos'] is the list of the panoramas of the unit
+            return the names of the units
+        '''
+
+        import json
+
+        numbers = [int(name.split('_')[1]) for state in ('pending', 'running', 'done') for name in self._names(state)]
+        number = max(numbers) + 1 if numbers else 0
+
+        names = []
+        for unit in units:
+            name = 'unit_%08d_%d.json'%(number, len(unit['panos']))
+            atomicWrite(self._path('pending', name), json.dumps(unit))
+            names.append(name)
+            number += 1
+
+        return names
+
+    def claim(self):
+        '''
+        claim a pending unit
+        return (name, unit), or None if there is no pending unit
+        '''
+
+        import json
+
+        for name in self._names('pending'):
+            try:
+                os.rename(self._path('pending', name), self._path('running', name))
+            except OSError:
+                # the unit is claimed by another worker
+                continue
+
+            self.heartbeat(name)
+            with open(self._path('running', name), 'r') as f:
+                return name, json.load(f)
+
+        return None
+
+    def heartbeat(self, name):
+        '''tell the other workers the running unit is still in progress'''
+
+        try:
+            os.utime(self._path('running', name), None)
+        except OSError:
+            pass
+
+    def complete(self, name):
+        '''move the running unit to the done folder'''
+
+        os.rename(self._path('running', name), self._path('done', name))
+
+    def release(self, name):
+        '''move the running unit back to the pending folder'''
+
+        os.rename(self._path('running', name), self._path('pending', name))
+
+    def reclaimStale(self):
+        '''move the running units not touched for longer than the lease back to the pending folder'''
+
+        import time
+
+        now = time.time()
+        for name in self._names('running'):
+            try:
+                if now - os.path.getmtime(self._path('running', name)) > self.lease:
+                    self.release(name)
+            except OSError:
+                pass
+
+    def clearDone(self):
+        '''remove the finished units'''
+
+        for name in self._names('done'):
+            try:
+                os.remove(self._path('done', name))
+            except OSError:
+                pass
+
+    def unfinished(self):
+        '''return the list of the pending and running units'''
+
+        import json
+
+        units = []
+        for state in ('pending', 'running'):
+            for name in self._names(state):
+                try:
+                    with open(self._path(state, name), 'r') as f:
+                        units.append(json.load(f))
+                except (IOError, OSError):
+                    # the pending unit is claimed, it is read in the running folder
+                    pass
+
+        return units
+
+    def counts(self):
+        '''
+        return the dictionary of the number of the panoramas in the pending,
+        running and done units
+        '''
+
+        return dict((state, sum(int(name[:-5].split('_')[2]) for name in self._names(state)))
+                    for state in ('pending', 'running', 'done'))
+
@@ -0,0 +1,58 @@
+# The regression test of the OTSU thresholding, graythresh counting the histogram with np.bincount
+# should return the same threshold as the original graythresh, see _originalGraythresh
+
+import warnings
+
+import numpy as np
+import pytest
+
+from Treepedia.GreenView_Benchmark import _originalGraythresh
+from Treepedia.GreenView_Calculate import graythresh
+
+
+def originalThreshold(array):
+    '''the threshold of the original function, which writes into its input and divides by zero'''
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return _originalGraythresh(array.copy(), 0.1)
+
+
+def exgImage(image):
+    '''the float ExG image of an uint8 image, the same as the one of VegetationMask'''
+
+    I = image/255.0
+    return (I[:,:,1] - I[:,:,0]) + (I[:,:,1] - I[:,:,2])
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_random_floats(seed):
+    # the ranges scaled by 255 (maximum not over 1) and the ones used as levels directly
+    rng = np.random.RandomState(seed)
+    for low, high in [(0, 1), (-1, 1), (-2, 1), (-2, 2), (0.5, 2), (-10, 255.5)]:
+        array = rng.uniform(low, high, size=(200, 200))
+        assert graythresh(array, 0.1) == originalThreshold(array)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_random_exg_images(seed):
+    # the maxima of the ExG images are over 1 with the pure green pixels, not over 1 without them
+    rng = np.random.RandomState(seed)
+    image = rng.randint(0, 256, size=(400, 400, 3)).astype(np.uint8)
+    image[..., 1] = np.maximum(image[..., 1], rng.randint(0, 256, size=(400, 400)))
+    dim = rng.randint(0, 128, size=(400, 400, 3)).astype(np.uint8)
+
+    for img in [image, dim, image//2 + dim//2]:
+        ExG = exgImage(img)
+        assert graythresh(ExG, 0.1) == originalThreshold(ExG)
+
+
+def test_levels_and_input():
+    # the values lying on the levels k/255 are truncated, and the input is not modified
+    ExG = np.arange(-255, 256)/255.0
+    copy = ExG.copy()
+    assert graythresh(ExG, 0.1) == originalThreshold(ExG)
+    assert np.array_equal(ExG, copy)
+
+    # the constant images fall back to the level
+    assert graythresh(np.zeros((10, 10)), 0.1) == originalThreshold(np.zeros((10, 10))) == 0.1
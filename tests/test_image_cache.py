@@ -0,0 +1,46 @@
+# The test of the image caches, the file cache keeps one total size for all the processes sharing
+# the folder, the packed cache only writes the access time of an image once in atimeResolution seconds
+
+import sqlite3
+
+from Treepedia.imageCache import FileImageCache, ImageCacheKey, PackedImageCache
+
+
+def test_file_shared_size(tmp_path):
+    # two caches on the same folder, as in two worker processes
+    caches = [FileImageCache(str(tmp_path), maxBytes=1000), FileImageCache(str(tmp_path), maxBytes=1000)]
+
+    for n in range(12):
+        caches[n % 2].put(ImageCacheKey('pano%d'%(n), 0, 0), b'x'*100)
+        assert caches[0]._scan()[1] <= 1000
+
+    # evicted to 90%, the oldest images are removed
+    assert caches[0]._readSize() == caches[0]._scan()[1]
+    assert caches[1].get(ImageCacheKey('pano0', 0, 0)) is None
+    assert caches[1].get(ImageCacheKey('pano11', 0, 0)) == b'x'*100
+
+    # replacing an image doesn't count it twice
+    size = caches[0]._readSize()
+    caches[0].put(ImageCacheKey('pano11', 0, 0), b'y'*100)
+    assert caches[1]._readSize() == size
+
+
+def atimeOf(cache, key):
+    with sqlite3.connect(str(cache.folder) + '/index.sqlite') as db:
+        return db.execute('SELECT atime FROM images WHERE key = ?', (key,)).fetchone()[0]
+
+
+def test_packed_coarse_atime(tmp_path):
+    key = ImageCacheKey('pano', 0, 0)
+    cache = PackedImageCache(str(tmp_path), atimeResolution=600)
+    cache.put(key, b'image')
+
+    atime = atimeOf(cache, key)
+    for n in range(10):
+        assert cache.get(key) == b'image'
+    assert atimeOf(cache, key) == atime
+
+    # the access time older than the resolution is written on the next hit
+    cache.atimeResolution = 0
+    assert cache.get(key) == b'image'
+    assert atimeOf(cache, key) > atime
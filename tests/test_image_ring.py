@@ -0,0 +1,155 @@
+# The test of the handoff of the images to the classifiers through the image ring, the results of
+# the classifier processes reading the shared memory slots should be the same as the ones of the
+# classification in this process, the finished panoramas are yielded while the fetchers are still
+# downloading, and closing the pipeline early stops the fetchers
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from Treepedia.GreenView_Calculate import BatchVegetationClassification, PanoramaClassification
+from Treepedia.greenViewPipeline import GSV_PANORAMA_URL, DecodeGSVImage, GreenViewPipeline
+from Treepedia.imageCache import ImageCacheKey, OpenImageCache
+from Treepedia.imageRing import ClassifySlot, ImageRing
+from Treepedia.keyScheduler import KeyScheduler
+
+
+HEADINGS = [0, 60, 120, 180, 240, 300]
+IMAGE_SIZE = 64
+
+classify = partial(PanoramaClassification, segmenter='none', counts=True)
+
+
+def randomImages(seed, count):
+    '''the (count, H, W, 3) stack of the greenish random images'''
+
+    rng = np.random.RandomState(seed)
+    images = rng.randint(0, 256, size=(count, IMAGE_SIZE, IMAGE_SIZE, 3)).astype(np.uint8)
+    images[..., 1] = np.maximum(images[..., 1], rng.randint(0, 256, size=images.shape[:3]))
+
+    return images
+
+
+def cachedPanoramas(folder, numPanos):
+    '''
+    save the jpg images of the panoramas in the image cache, so the pipeline reads
+    them from the cache without any request, return the cache and the panoramas
+    '''
+
+    cache = OpenImageCache(str(folder))
+    panoLst = []
+    for n in range(numPanos):
+        panoID = 'pano%d'%(n)
+        for heading, image in zip(HEADINGS, randomImages(n, len(HEADINGS))):
+            data = BytesIO()
+            Image.fromarray(image).save(data, 'JPEG')
+            cache.put(ImageCacheKey(panoID, heading, 0, 60, '%dx%d'%(IMAGE_SIZE, IMAGE_SIZE)), data.getvalue())
+        panoLst.append((panoID, '2017-06', '-71.1', '42.3'))
+
+    return cache, panoLst
+
+
+def pipelineResults(cache, panoLst, numClassifiers):
+    pipeline = GreenViewPipeline(panoLst, KeyScheduler(['key']), classify, HEADINGS, numFetchers=2,
+                                 numClassifiers=numClassifiers, queueSize=2, cache=cache, imageSize=IMAGE_SIZE)
+
+    return dict((pano[0], [tuple(result) for result in results]) for pano, results in pipeline)
+
+
+def test_classify_slot():
+    ring = ImageRing(3, (len(HEADINGS), IMAGE_SIZE, IMAGE_SIZE, 3), shared=True)
+    try:
+        assert ring.shared
+        for index in range(3):
+            ring.slot(index)[...] = randomImages(index, len(HEADINGS))
+
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(ClassifySlot, classify, ring.name, ring.numSlots, ring.slotShape, index, 4)
+                       for index in range(3)]
+            for index, future in enumerate(futures):
+                expected = BatchVegetationClassification(randomImages(index, len(HEADINGS))[:4], segmenter='none', counts=True)
+                assert np.array_equal(future.result(), expected)
+    finally:
+        ring.close()
+
+
+def test_pipeline_shared_memory(tmp_path):
+    cache, panoLst = cachedPanoramas(tmp_path, 8)
+
+    local = pipelineResults(cache, panoLst, 0)
+    shared = pipelineResults(cache, panoLst, 2)
+
+    assert sorted(local) == sorted(pano[0] for pano in panoLst)
+    assert shared == local
+
+    # the results are the ones of the decoded images
+    for panoID, results in local.items():
+        key = lambda heading: ImageCacheKey(panoID, heading, 0, 60, '%dx%d'%(IMAGE_SIZE, IMAGE_SIZE))
+        images = np.stack([DecodeGSVImage(cache.get(key(heading))) for heading in HEADINGS])
+        expected = BatchVegetationClassification(images, segmenter='none', counts=True)
+        assert results == [tuple(result) for result in expected]
+
+
+class SlowCache(object):
+    '''the image cache waiting delay seconds before reading the first image of the slow panoramas'''
+
+    def __init__(self, cache, slowIDs, delay):
+        self.cache = cache
+        self.slowIDs = slowIDs
+        self.delay = delay
+
+    def get(self, key):
+        for panoID in self.slowIDs:
+            if key == ImageCacheKey(panoID, HEADINGS[0], 0, 60, '%dx%d'%(IMAGE_SIZE, IMAGE_SIZE)):
+                time.sleep(self.delay)
+        return self.cache.get(key)
+
+    def put(self, key, data):
+        self.cache.put(key, data)
+
+
+def test_pipeline_yields_while_fetching(tmp_path):
+    cache, panoLst = cachedPanoramas(tmp_path, 2)
+
+    # the first panorama is classified while the only fetcher downloads the second one
+    pipeline = GreenViewPipeline(panoLst, KeyScheduler(['key']), classify, HEADINGS, numFetchers=1,
+                                 numClassifiers=1, queueSize=2, cache=SlowCache(cache, ['pano1'], 5),
+                                 imageSize=IMAGE_SIZE)
+    start = time.time()
+    pano, results = next(pipeline)
+    assert pano[0] == 'pano0'
+    assert time.time() - start < 4
+    pipeline.close()
+
+
+def test_pipeline_close_stops_fetchers(tmp_path):
+    cache, panoLst = cachedPanoramas(tmp_path, 12)
+    numThreads = threading.active_count()
+
+    for numClassifiers in [0, 1]:
+        pipeline = GreenViewPipeline(panoLst, KeyScheduler(['key']), classify, HEADINGS, numFetchers=3,
+                                     numClassifiers=numClassifiers, queueSize=1, cache=cache, imageSize=IMAGE_SIZE)
+        next(pipeline)
+
+        # the fetchers waiting for the full queue
+        time.sleep(0.5)
+        pipeline.close()
+
+        deadline = time.time() + 5
+        while threading.active_count() > numThreads and time.time() < deadline:
+            time.sleep(0.05)
+        assert threading.active_count() == numThreads
+
+
+def test_pipeline_panorama_options():
+    # GSV serves no whole panorama, and its tiles need the yaw
+    for tiles, URL, yaw in [(None, GSV_PANORAMA_URL, None), ((8, 4), GSV_PANORAMA_URL, None)]:
+        with pytest.raises(ValueError):
+            next(GreenViewPipeline([('pano0',)], KeyScheduler(['key']), classify, HEADINGS, numClassifiers=0,
+                                   panoramaZoom=3, panoramaTiles=tiles, panoramaURL=URL, panoramaYaw=yaw))
@@ -0,0 +1,91 @@
+# The test of the rate and the daily quota of the API keys, a green view worker downloads the GSV
+# images from a local http server with the KeyScheduler, the server records the key and the time
+# of every request, every key should keep its rate and send no more than its daily quota
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from Treepedia.GreenView_Calculate import GreenViewWorker
+from Treepedia.workQueue import ShardPanoramas, WorkQueue
+
+
+KEYS = ['key1', 'key2']
+RATE = 10
+QUOTA = 15
+IMAGE_SIZE = 64
+
+
+def jpgImage():
+    image = np.random.RandomState(0).randint(0, 256, size=(IMAGE_SIZE, IMAGE_SIZE, 3)).astype(np.uint8)
+    data = BytesIO()
+    Image.fromarray(image).save(data, 'JPEG')
+    return data.getvalue()
+
+
+@pytest.fixture
+def server():
+    '''the local server of the GSV images, yields its URL and the list of the (key, time) of the requests'''
+
+    requests = []
+    lock = threading.Lock()
+    image = jpgImage()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            key = parse_qs(urlparse(self.path).query)['key'][0]
+            with lock:
+                requests.append((key, time.time()))
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(image)))
+            self.end_headers()
+            self.wfile.write(image)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        yield 'http://127.0.0.1:%d/streetview'%(httpd.server_address[1]), requests
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_rate_and_quota(tmp_path, server):
+    URL, requests = server
+
+    # more panos than the quota of the keys, the worker stops when the quota is used up
+    panoLst = [('pano%d'%(n), '2017-06', '-71.1', '42.3') for n in range(20)]
+    queueFolder = str(tmp_path/'workQueue')
+    WorkQueue(queueFolder).add([{'source': 'Pnt_start0_end20.txt', 'panos': panos}
+                                for panos in ShardPanoramas(panoLst, 5)])
+
+    GreenViewWorker(queueFolder, str(tmp_path), KEYS, segmenter='none', rate=RATE, numFetchers=4,
+                    dailyQuota=QUOTA, imageSize=IMAGE_SIZE, baseURL=URL)
+
+    # every key sent its whole quota and no more, the reserved requests were all sent or given back
+    for key in KEYS:
+        times = sorted(t for k, t in requests if k == key)
+        assert len(times) == QUOTA
+
+        # the requests of a key are 1/RATE apart, a little jitter of the threads is allowed
+        for n in range(len(times) - RATE):
+            assert times[n + RATE] - times[n] >= 1 - 0.1
+
+    with open(str(tmp_path/'keyState.json')) as f:
+        state = json.load(f)
+    assert dict((key, state['keys'][key]['used']) for key in KEYS) == {'key1': QUOTA, 'key2': QUOTA}
@@ -0,0 +1,86 @@
+# The test of the download of the panoramas, the tiles and the yaws are requested without API key
+# through the scheduler of the panorama requests, so they keep the rate of the keys without using
+# their daily quota, and the cached tiles are kept apart by their server, zoom and tiles
+
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from Treepedia.greenViewPipeline import GetGSVPanorama, PanoramaScheduler
+from Treepedia.imageCache import FileImageCache
+from Treepedia.keyScheduler import KeyScheduler
+from Treepedia.metadataCollector import FetchPanoramaYaw
+
+
+TILE_SIZE = 32
+
+
+class Response(object):
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+class TileSession(object):
+    '''the requests session serving the tiles, the tile x is filled with the gray level 50*x'''
+
+    def __init__(self):
+        self.URLs = []
+
+    def get(self, URL, timeout=None):
+        self.URLs.append(URL)
+        params = dict(param.split('=') for param in URL.split('?')[1].split('&'))
+        if params['output'] == 'xml':
+            return Response(b'<panorama><projection_properties pano_yaw_deg="123.5"/></panorama>')
+
+        tile = np.full((TILE_SIZE, TILE_SIZE, 3), 50*int(params['x']), dtype=np.uint8)
+        data = BytesIO()
+        Image.fromarray(tile).save(data, 'PNG')
+        return Response(data.getvalue())
+
+
+def test_tiles_without_quota():
+    keys = KeyScheduler(['key1', 'key2'], rate=10, dailyQuota=1)
+    scheduler = PanoramaScheduler(keys)
+    session = TileSession()
+
+    panorama = GetGSVPanorama(session, scheduler, 'pano', 1, (4, 2))
+    assert panorama.shape == (2*TILE_SIZE, 4*TILE_SIZE, 3)
+    assert panorama[0, ::TILE_SIZE, 0].tolist() == [0, 50, 100, 150]
+
+    # eight tiles and a yaw, far over the quota of the keys, without any key
+    assert FetchPanoramaYaw(session, scheduler, 'pano') == 123.5
+    assert len(session.URLs) == 9
+    assert not any('key=' in URL for URL in session.URLs)
+    assert keys.usage() == {'key1': 0, 'key2': 0}
+
+
+def test_panorama_rate():
+    # the total rate of the two keys
+    scheduler = PanoramaScheduler(KeyScheduler(['key1', 'key2'], rate=10))
+    assert scheduler.rate == 20
+
+    start = time.time()
+    for n in range(11):
+        scheduler.acquire()
+    assert time.time() - start >= 0.45
+
+
+def test_panorama_cache_key(tmp_path):
+    scheduler = PanoramaScheduler(KeyScheduler(['key'], rate=1000))
+    cache = FileImageCache(str(tmp_path))
+    session = TileSession()
+
+    GetGSVPanorama(session, scheduler, 'pano', 1, (2, 1), cache, 'http://server1/cbk')
+    GetGSVPanorama(session, scheduler, 'pano', 1, (2, 1), cache, 'http://server1/cbk')
+    assert len(session.URLs) == 2
+
+    # another server, zoom or tiles is not read from the cache
+    GetGSVPanorama(session, scheduler, 'pano', 1, (2, 1), cache, 'http://server2/cbk')
+    GetGSVPanorama(session, scheduler, 'pano', 2, (2, 1), cache, 'http://server1/cbk')
+    GetGSVPanorama(session, scheduler, 'pano', 1, (1, 1), cache, 'http://server1/cbk')
+    assert len(session.URLs) == 7
@@ -0,0 +1,35 @@
+# The test of the jobs of the state database, a done job is only skipped while the file it wrote
+# exists, so deleting a Pnt_*.txt file of the metadata collector makes the batch collected again
+
+from Treepedia.pipelineState import PipelineState
+
+
+def test_done_job_with_deleted_output(tmp_path):
+    state = PipelineState(str(tmp_path/'state.db'))
+    output = tmp_path/'Pnt_start0_end10.txt'
+
+    assert state.claimJob(output.name, 'worker1', str(output))
+    output.write_text('done\n')
+    state.finishJob(output.name)
+
+    # done, the file exists
+    assert not state.claimJob(output.name, 'worker2', str(output))
+
+    # the file is deleted, the batch is claimed again, and not by two workers
+    output.unlink()
+    assert state.claimJob(output.name, 'worker2', str(output))
+    assert not state.claimJob(output.name, 'worker3', str(output))
+    assert state.isJobRunning(output.name)
+
+
+def test_done_job_without_output(tmp_path):
+    state = PipelineState(str(tmp_path/'state.db'))
+
+    assert state.claimJob('job', 'worker1')
+    assert not state.claimJob('job', 'worker2')
+    state.finishJob('job')
+    assert not state.claimJob('job', 'worker2')
+
+    # a failed job is taken again
+    state.finishJob('job', 'failed')
+    assert state.claimJob('job', 'worker2')
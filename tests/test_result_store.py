@@ -0,0 +1,52 @@
+# The test of the recovery of the result store after a crash between the write of the records
+# and the write of their index entry, the orphaned records should still be found by the queries
+
+import os
+
+import numpy as np
+
+from Treepedia.resultStore import ResultRecords, ResultStore, _dtypes
+
+
+def crashedAppend(store, records):
+    '''append the records without their index entry, as a crash after the fsync of the store does'''
+
+    with open(store.storeFile, 'ab') as f:
+        f.write(records.tobytes())
+
+
+def test_orphans_before_append(tmp_path):
+    store = ResultStore(str(tmp_path/'results.bin'))
+
+    store.append(ResultRecords(['a'], ['2015-06'], [10.0], [50.0], [0.1]))
+    crashedAppend(store, ResultRecords(['orphan'], ['2012-01'], [-70.0], [40.0], [0.2]))
+    store.append(ResultRecords(['b'], ['2016-06'], [11.0], [51.0], [0.3]))
+
+    found = store.query(startDate='2012-01', endDate='2012-12')
+    assert found['panoID'].tolist() == [b'orphan']
+    found = store.query(bbox=(-71.0, 39.0, -69.0, 41.0))
+    assert found['panoID'].tolist() == [b'orphan']
+
+    # the orphans got their own bounded entry when the next block was appended
+    blocks = store.blocks()
+    assert blocks['start'].tolist() == [0, 1, 2]
+    assert blocks['maxDate'].tolist() == [b'2015-06', b'2012-01', b'2016-06']
+
+
+def test_gaps_of_the_index(tmp_path):
+    store = ResultStore(str(tmp_path/'results.bin'))
+
+    store.append(ResultRecords(['a'], ['2015-06'], [10.0], [50.0]))
+    crashedAppend(store, ResultRecords(['orphan'], ['2012-01'], [-70.0], [40.0]))
+    store.append(ResultRecords(['b'], ['2016-06'], [11.0], [51.0]))
+
+    # the index of an older version without the entry of the orphans
+    BLOCK_DTYPE = _dtypes()[1]
+    with open(store.indexFile, 'rb') as f:
+        blocks = np.frombuffer(f.read(), dtype=BLOCK_DTYPE)
+    with open(store.indexFile, 'wb') as f:
+        f.write(blocks[blocks['start'] != 1].tobytes())
+
+    assert store.query(startDate='2012-01', endDate='2012-12')['panoID'].tolist() == [b'orphan']
+    assert len(store.query()) == 3
+    assert os.path.getsize(store.indexFile) == 2*BLOCK_DTYPE.itemsize
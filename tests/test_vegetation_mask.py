@@ -0,0 +1,111 @@
+# The regression test of the vegetation masks, the default float VegetationMask and the batch
+# classification should be the same as the original float classification pixel for pixel, the
+# integer IntegerVegetationMask as the original float rule ExG > threshold for the thresholds not
+# lying on an ExG level k/255
+
+import warnings
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+from Treepedia.GreenView_Benchmark import _originalGraythresh
+from Treepedia.GreenView_Calculate import (BatchVegetationClassification, ExGLevelCutoff,
+                                           IntegerVegetationMask, VegetationMask)
+
+
+# the thresholds at, between and out of the limits of [0.05, 0.1], on and off the ExG levels k/255
+THRESHOLDS = [0.0, 0.05, 0.06, 13/255.0, 0.0625, 0.08, 20/255.0, 0.1, 0.2]
+
+# the thresholds not lying on an ExG level, after the limits of [0.05, 0.1]
+OFF_LEVEL_THRESHOLDS = [0.0, 0.05, 0.06, 0.0625, 0.08, 0.1, 0.2]
+
+
+def allColors():
+    '''the image of all the 2**24 RGB triples, in shape of (4096, 4096, 3)'''
+
+    levels = np.arange(2**24, dtype=np.uint32)
+    image = np.empty((2**24, 3), dtype=np.uint8)
+    image[:, 0] = levels >> 16
+    image[:, 1] = (levels >> 8) & 255
+    image[:, 2] = levels & 255
+
+    return image.reshape(4096, 4096, 3)
+
+
+def originalMask(segmented_image, threshold=None):
+    '''
+    the mask of the original float classification, comparing ExG with the threshold itself,
+    the threshold is chosen by the original graythresh if it is None
+    '''
+
+    I = segmented_image/255.0
+    red, green, blue = I[:,:,0], I[:,:,1], I[:,:,2]
+    ExG = (green - red) + (green - blue)
+
+    if threshold is None:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            threshold = _originalGraythresh(ExG.copy(), 0.1)
+    threshold = min(max(threshold, 0.05), 0.1)
+
+    greenImg1 = (red < 0.6)*(blue < 0.6)*(green < 0.9)
+    greenImgShadow1 = (red < 0.3)*(green < 0.3)*(blue < 0.3)
+
+    return greenImg1*(ExG > threshold) + (ExG > 0.05)*greenImgShadow1
+
+
+def randomImages(seed, count):
+    '''the greenish images, so the Otsu thresholds are spread over the range of [0.05, 0.1]'''
+
+    rng = np.random.RandomState(seed)
+    images = rng.randint(0, 256, size=(count, 400, 400, 3)).astype(np.uint8)
+    images[..., 1] = np.maximum(images[..., 1], rng.randint(0, 256, size=(count, 400, 400)))
+
+    # without the pure green pixels the maximum of ExG is not over 1 and graythresh scales it
+    images[1::2] //= 2
+
+    return images
+
+
+@pytest.fixture(scope='module')
+def colors():
+    return allColors()
+
+
+@pytest.mark.parametrize('threshold', THRESHOLDS)
+def test_float_original_all_colors(colors, threshold):
+    for rows in range(0, colors.shape[0], 1024):
+        image = colors[rows:rows + 1024]
+        assert np.array_equal(VegetationMask(image, threshold), originalMask(image, threshold))
+
+
+@pytest.mark.parametrize('threshold', OFF_LEVEL_THRESHOLDS)
+def test_integer_original_all_colors(colors, threshold):
+    for rows in range(0, colors.shape[0], 1024):
+        image = colors[rows:rows + 1024]
+        assert np.array_equal(IntegerVegetationMask(image, threshold), originalMask(image, threshold))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_images(seed):
+    # the Otsu threshold of the image is used
+    images = randomImages(seed, 4)
+    for image in images:
+        assert np.array_equal(VegetationMask(image), originalMask(image))
+
+    counts = BatchVegetationClassification(images, segmenter='none', counts=True)
+    assert counts[:, 0].tolist() == [np.count_nonzero(originalMask(image)) for image in images]
+
+
+def test_level_cutoff():
+    # the thresholds on a level k/255 are cut at the level itself, ExG > threshold is k > K
+    # also when the level is one ulp off, e.g. k*(1/255.0)
+    for k in range(256):
+        assert ExGLevelCutoff(k/255.0) == k
+        assert ExGLevelCutoff(k*(1/255.0)) == k
+
+    # the other thresholds are cut at the level below them
+    for threshold in np.linspace(0, 1, 10007):
+        if abs(threshold*255 - round(threshold*255)) > 1e-5:
+            assert ExGLevelCutoff(threshold) == int(Fraction(float(threshold))*255)